@@ -0,0 +1,168 @@
+#! /usr/bin/env python3.6
+"""
+Many headless games at once, for tuning the game parameters
+
+Every combination of the given attractor masses, emitter speeds, launch
+times and attractor policies is played with every seed, on all CPU cores.
+The results are aggregated per combination, eg
+
+    python3 batch.py --mass 100 150 200 --launch-time 6 7 8 --seeds 50
+
+prints a table and optionally writes everything as JSON.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import random
+import statistics
+import sys
+
+from engine import Simulation, ATTRACTOR_MASS, EMITTER_SPEED, LAUNCH_TIME
+
+
+# Attractor policies. Each is called before every tick with the simulation
+# and a seeded RNG of its own, and moves attractors however it wants
+
+def still_policy(simulation, rng):
+    # Never touches the attractors
+    pass
+
+
+def random_policy(simulation, rng, every=40):
+    # Drags a random attractor to a random place every `every` ticks
+    if simulation.ticks % every == 0:
+        simulation.move_attractor(
+            rng.randrange(len(simulation.attractors)),
+            (rng.randrange(simulation.size[0] - 4),
+             rng.randrange(simulation.size[1] - 4)))
+
+
+def follow_policy(simulation, rng, every=15):
+    # Keeps the first attractor a bit ahead of the flying figure, which
+    # roughly drags it along its launch trajectory
+    if simulation.ticks % every == 0 and simulation.figure:
+        # The figure's own velocity is only updated when it leaves the swarm
+        simulation.swarm.sync(simulation.figure)
+        x, y = simulation.figure.pos
+        x = int(x + simulation.figure.vx) - 2
+        y = int(y + simulation.figure.vy) - 2
+        simulation.move_attractor(
+            0, (min(max(x, 0), simulation.size[0] - 5),
+                min(max(y, 0), simulation.size[1] - 5)))
+
+
+POLICIES = {'still': still_policy,
+            'random': random_policy,
+            'follow': follow_policy}
+
+
+def play(job):
+    """
+    Play a single game
+    :param job: dict with mass, emitter_speed, launch_time, policy, seed and
+    ticks (max game length)
+    :return: the same dict, with the results added
+    """
+    simulation = Simulation(seed=job['seed'], mass=job['mass'],
+                            emitter_speed=tuple(job['emitter_speed']),
+                            launch_time=job['launch_time'])
+    policy = POLICIES[job['policy']]
+    rng = random.Random(job['seed'])
+    while not simulation.lost and simulation.ticks < job['ticks']:
+        policy(simulation, rng)
+        simulation.step()
+    r = dict(job)
+    r.update(score=simulation.score, installations=simulation.installations,
+             fly_aways=simulation.fly_aways, length=simulation.ticks,
+             lost=simulation.lost)
+    return r
+
+
+def make_jobs(masses, speeds, launch_times, policies, seeds, ticks):
+    return [{'mass': mass, 'emitter_speed': (speed, speed),
+             'launch_time': launch_time, 'policy': policy, 'seed': seed,
+             'ticks': ticks}
+            for mass, speed, launch_time, policy, seed in itertools.product(
+                masses, speeds, launch_times, policies, seeds)]
+
+
+def run_batch(jobs, processes=None):
+    """
+    Play all the games in a process pool
+    :param jobs: list of `play` job dicts
+    :param processes: number of processes. Defaults to the number of CPUs
+    :return: list of results, in the same order as jobs
+    """
+    with multiprocessing.Pool(processes) as pool:
+        chunk = max(1, len(jobs) // (4 * (processes or
+                                          multiprocessing.cpu_count())))
+        return pool.map(play, jobs, chunksize=chunk)
+
+
+def aggregate(results):
+    """
+    Summarize the results for every parameter combination
+    :param results: list of `play` results
+    :return: list of dicts
+    """
+    groups = {}
+    for result in results:
+        key = (result['mass'], tuple(result['emitter_speed']),
+               result['launch_time'], result['policy'])
+        groups.setdefault(key, []).append(result)
+    r = []
+    for (mass, speed, launch_time, policy), games in groups.items():
+        scores = [x['score'] for x in games]
+        r.append({'mass': mass, 'emitter_speed': speed,
+                  'launch_time': launch_time, 'policy': policy,
+                  'games': len(games),
+                  'score_mean': statistics.mean(scores),
+                  'score_median': statistics.median(scores),
+                  'score_max': max(scores),
+                  'installations_mean': statistics.mean(
+                      x['installations'] for x in games),
+                  'fly_aways_mean': statistics.mean(
+                      x['fly_aways'] for x in games),
+                  'length_mean': statistics.mean(x['length'] for x in games),
+                  'loss_rate': sum(x['lost'] for x in games) / len(games)})
+    return r
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play many headless games')
+    parser.add_argument('--mass', type=float, nargs='+',
+                        default=[ATTRACTOR_MASS])
+    parser.add_argument('--speed', type=float, nargs='+',
+                        default=[EMITTER_SPEED[0]],
+                        help='emitter speed, cells per second')
+    parser.add_argument('--launch-time', type=float, nargs='+',
+                        default=[LAUNCH_TIME])
+    parser.add_argument('--policy', nargs='+', default=['random'],
+                        choices=sorted(POLICIES))
+    parser.add_argument('--seeds', type=int, default=20,
+                        help='number of games per combination')
+    parser.add_argument('--ticks', type=int, default=9000,
+                        help='max game length, in ticks')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+    jobs = make_jobs(args.mass, args.speed, args.launch_time, args.policy,
+                     range(args.seeds), args.ticks)
+    results = run_batch(jobs, args.processes)
+    report = aggregate(results)
+    for row in report:
+        print('mass {mass:g} speed {emitter_speed[0]:g} launch '
+              '{launch_time:g} {policy:7} score {score_mean:7.2f} '
+              'installs {installations_mean:6.2f} fly-aways '
+              '{fly_aways_mean:6.2f} length {length_mean:8.1f} lost '
+              '{loss_rate:.2f}'.format(**row))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'report': report, 'games': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+#! /usr/bin/env python3.6
+"""
+Benchmarks for the game core
+
+Runs without a window, on the headless engine only. Every benchmark is run
+several times and its min and median times are reported; the results can be
+written as JSON and compared against a baseline from an earlier run, eg:
+
+    python3 benchmark.py --save baseline.json
+    ...change something...
+    python3 benchmark.py --baseline baseline.json
+
+which exits with 1 if anything got slower than the baseline by more than
+`--threshold` times.
+"""
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from engine import GravityField, OnDemandGravityField, TetrisSystem, Mass,\
+    Simulation, FIGURES, FIGURE_MASKS, START_FIGURE, ATTRACTOR_MASS,\
+    board_layout, gravity_kernel
+
+
+FIELD_SIZES = ((60, 45), (240, 180), (960, 720))
+ATTRACTOR_COUNTS = (2, 8)
+
+
+def measure(func, setup=None, repeat=7, number=1):
+    """
+    Time a function
+
+    :param func: a function of whatever `setup` returns, or of nothing
+    :param setup: called before every repeat, not timed
+    :param repeat: number of timed repeats
+    :param number: calls per repeat
+    :return: dict of per-call times
+    """
+    times = []
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        for _ in range(number):
+            func(*args)
+        times.append((time.perf_counter() - start) / number)
+    return {'min': min(times), 'median': statistics.median(times),
+            'repeat': repeat, 'number': number}
+
+
+def bench_field(results):
+    rng = random.Random(0)
+    for size in FIELD_SIZES:
+        for count in ATTRACTOR_COUNTS:
+            positions = [(rng.randrange(size[0]), rng.randrange(size[1]))
+                         for _ in range(count)]
+            name = '{}x{}/{}'.format(size[0], size[1], count)
+
+            def add():
+                # Without cached kernels, ie the cost of the first game
+                gravity_kernel.cache_clear()
+                field = GravityField(size)
+                for pos in positions:
+                    field.add_attractor(Mass(mass=ATTRACTOR_MASS), pos)
+            results['field_add/' + name] = measure(add, repeat=5)
+
+            def make_field():
+                field = GravityField(size)
+                attractors = [Mass(mass=ATTRACTOR_MASS) for _ in positions]
+                for attractor, pos in zip(attractors, positions):
+                    field.add_attractor(attractor, pos)
+                moves = [(attractors[rng.randrange(count)],
+                          (rng.randrange(size[0]), rng.randrange(size[1])))
+                         for _ in range(100)]
+                return field, moves
+
+            def move(args):
+                field, moves = args
+                for attractor, pos in moves:
+                    field.move_attractor(attractor, pos)
+            r = measure(move, setup=make_field)
+            # Per move rather than per 100 moves
+            results['field_move/' + name] = {
+                key: value / 100 if key in ('min', 'median') else value
+                for key, value in r.items()}
+
+
+def bench_swarm(results):
+    # Every attractor moves every frame, with either solver
+    rng = random.Random(0)
+    size = (60, 45)
+    for solver in ('direct', 'fft'):
+        for count in (10, 100, 300):
+            def make_field():
+                field = GravityField(size, lazy=True, solver=solver)
+                attractors = [Mass(mass=ATTRACTOR_MASS) for _ in range(count)]
+                for attractor in attractors:
+                    field.add_attractor(attractor,
+                                        (rng.randrange(size[0] - 4),
+                                         rng.randrange(size[1] - 4)))
+                field.update()
+                moves = [(attractor, (rng.randrange(size[0] - 4),
+                                      rng.randrange(size[1] - 4)))
+                         for attractor in attractors]
+                return field, moves
+
+            def move_all(args):
+                field, moves = args
+                for attractor, pos in moves:
+                    field.move_attractor(attractor, pos)
+                field.update()
+            results['field_swarm/{}/{}'.format(solver, count)] = measure(
+                move_all, setup=make_field)
+
+
+def bench_frame(results):
+    # A typical frame: an attractor is dragged and a few figures look up the
+    # field, with a lazy field and an on-demand one
+    rng = random.Random(0)
+    for size in FIELD_SIZES:
+        for name, make in (('lazy', lambda: GravityField(size, lazy=True)),
+                           ('on_demand', lambda: OnDemandGravityField(size))):
+            def make_field():
+                field = make()
+                attractors = [Mass(mass=ATTRACTOR_MASS) for _ in range(2)]
+                for attractor in attractors:
+                    field.add_attractor(attractor, (rng.randrange(size[0]),
+                                                    rng.randrange(size[1])))
+                frames = [(attractors[rng.randrange(2)],
+                           (rng.randrange(size[0]), rng.randrange(size[1])),
+                           np.array([rng.randrange(size[0])
+                                     for _ in range(4)]),
+                           np.array([rng.randrange(size[1])
+                                     for _ in range(4)]))
+                          for _ in range(100)]
+                return field, frames
+
+            def frame(args):
+                field, frames = args
+                for attractor, pos, xs, ys in frames:
+                    field.move_attractor(attractor, pos)
+                    field.sample(xs, ys)
+            r = measure(frame, setup=make_field)
+            results['field_frame/{}/{}x{}'.format(name, *size)] = {
+                key: value / 100 if key in ('min', 'median') else value
+                for key, value in r.items()}
+
+
+def bench_check_move(results):
+    rng = random.Random(0)
+    size = (60, 45)
+    tetris = TetrisSystem(size)
+    tetris.install(board_layout(size).start, START_FIGURE)
+    positions = [(rng.randrange(size[0] - 4), rng.randrange(size[1] - 4))
+                 for _ in range(1000)]
+    for name, chars in FIGURES.items():
+        # Figures carry their mask, so the game never builds one per check
+        mask = FIGURE_MASKS[name]
+
+        def check():
+            for pos in positions:
+                tetris.check_move(pos, chars, mask)
+        r = measure(check)
+        results['check_move/' + name] = {
+            key: value / len(positions) if key in ('min', 'median') else value
+            for key, value in r.items()}
+
+
+def random_board(size, density, seed):
+    # A board filled with installed cells at a given density
+    rng = np.random.RandomState(seed)
+    tetris = TetrisSystem(size)
+    for x, y in zip(*np.nonzero(rng.random_sample(size) < density)):
+        if tetris[x][y] == 0:
+            tetris[x][y] = 1
+    return tetris
+
+
+def bench_removal(results):
+    for name, density in (('sparse', 0.05), ('dense', 0.6)):
+        board = random_board((60, 45), density, 0)
+        # Removal changes the board, so every repeat gets a fresh copy
+        results['check_for_removal/' + name] = measure(
+            lambda tetris: tetris.check_for_removal(), setup=board.copy)
+
+
+def bench_simulation(results, ticks):
+    def run():
+        simulation = Simulation(seed=1)
+        moves = random.Random(1)
+        for tick in range(ticks):
+            if tick % 40 == 0:
+                simulation.move_attractor(moves.randrange(2),
+                                          (moves.randrange(56),
+                                           moves.randrange(41)))
+            simulation.step()
+    results['simulation/{}'.format(ticks)] = measure(run, repeat=3)
+
+
+def run_benchmarks(ticks=3000):
+    """
+    Run all benchmarks
+    :param ticks: length of the simulated game
+    :return: JSON-friendly dict
+    """
+    results = {}
+    bench_field(results)
+    bench_swarm(results)
+    bench_frame(results)
+    bench_check_move(results)
+    bench_removal(results)
+    bench_simulation(results, ticks)
+    return {'meta': {'python': platform.python_version(),
+                     'numpy': np.__version__,
+                     'machine': platform.machine(),
+                     'platform': platform.platform(),
+                     'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'results': results}
+
+
+def compare(current, baseline, threshold):
+    """
+    Compare median times with a baseline
+    :param current: run_benchmarks output
+    :param baseline: run_benchmarks output from an earlier run
+    :param threshold: max allowed ratio of current to baseline time
+    :return: list of (name, baseline, current, ratio, regressed) tuples
+    """
+    r = []
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['median']
+        ratio = result['median'] / old if old else float('inf')
+        r.append((name, old, result['median'], ratio, ratio > threshold))
+    return r
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the game core')
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare with results from an '
+                                           'earlier run')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='slowdown ratio that counts as a regression')
+    parser.add_argument('--ticks', type=int, default=3000,
+                        help='length of the simulated game')
+    args = parser.parse_args()
+    current = run_benchmarks(args.ticks)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=2)
+    regressed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for name, old, new, ratio, slower in compare(current, baseline,
+                                                     args.threshold):
+            print('{:40} {:12.3e} {:12.3e} {:6.2f}{}'.format(
+                name, old, new, ratio, '  REGRESSION' if slower else ''))
+            regressed = regressed or slower
+    else:
+        for name, result in current['results'].items():
+            print('{:40} {:12.3e}'.format(name, result['median']))
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
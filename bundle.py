@@ -0,0 +1,198 @@
+"""
+Binary asset bundle
+
+All the atlas elements from indirectris.xp and indirectris.json, sliced in
+advance and stored in a single file that is memory-mapped at startup instead
+of parsing the XP image. Building a bundle needs bear_hug's loaders, reading
+it doesn't.
+
+File layout, all little-endian:
+    header (see HEADER)
+    strings: element names, then the palette of chars and colors; each is a
+        uint16 byte length followed by UTF-8 bytes
+    element table: (xsize, ysize, first cell) for every element, in the same
+        order as the names
+    cells, starting at `cells_offset`: uint16 pairs of (char, color) palette
+        indices, row by row for every element
+"""
+
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+
+
+MAGIC = b'IXAB'
+VERSION = 1
+# Magic, version, mtimes of the xp and json files it was built from, element
+# count, string count and the offset of the cell array
+HEADER = struct.Struct('<4sIddIII')
+STRING_LENGTH = struct.Struct('<H')
+ELEMENT = np.dtype([('xsize', '<u2'), ('ysize', '<u2'), ('start', '<u4')])
+CELL = np.dtype('<u2')
+
+
+def source_mtimes(xp_file, json_file):
+    """
+    Return mtimes of the source files, or 0 for those that don't exist
+    :param xp_file:
+    :param json_file:
+    :return:
+    """
+    return tuple(os.stat(x).st_mtime if os.path.exists(x) else 0
+                 for x in (xp_file, json_file))
+
+
+def build_bundle(xp_file, json_file, bundle_file):
+    """
+    Slice every atlas element and write them into a bundle
+
+    The file is written next to the bundle and then moved in its place, so a
+    bundle that exists is always complete.
+    :param xp_file: path to the REXPaint image
+    :param json_file: path to the atlas JSON
+    :param bundle_file: path to the bundle
+    :return:
+    """
+    from bear_hug.resources import XpLoader, Atlas
+    atlas = Atlas(XpLoader(xp_file), json_file)
+    names = list(atlas.elements)
+    palette = []
+    index = {}
+    table = np.zeros(len(names), dtype=ELEMENT)
+    cells = []
+    for i, name in enumerate(names):
+        chars, colors = atlas.get_element(name)
+        table[i] = (len(chars[0]), len(chars), len(cells))
+        for char_row, color_row in zip(chars, colors):
+            for value in zip(char_row, color_row):
+                for item in value:
+                    if item not in index:
+                        index[item] = len(palette)
+                        palette.append(item)
+                cells.append((index[value[0]], index[value[1]]))
+    strings = b''.join(STRING_LENGTH.pack(len(x)) + x
+                       for x in (s.encode('utf-8') for s in names + palette))
+    table_offset = HEADER.size + len(strings)
+    # Cells are aligned, so that they can be viewed in place
+    cells_offset = (table_offset + table.nbytes + 7) // 8 * 8
+    header = HEADER.pack(MAGIC, VERSION, *source_mtimes(xp_file, json_file),
+                         len(names), len(names) + len(palette), cells_offset)
+    tmp_file = bundle_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(header)
+        f.write(strings)
+        f.write(table.tobytes())
+        f.write(b'\0' * (cells_offset - table_offset - table.nbytes))
+        f.write(np.array(cells, dtype=CELL).tobytes())
+    os.replace(tmp_file, bundle_file)
+
+
+def is_stale(xp_file, json_file, bundle_file):
+    """
+    Check whether a bundle needs to be rebuilt
+
+    A bundle is stale if it's missing, has a different version or was built
+    from source files with different mtimes. Sources that don't exist aren't
+    compared, so a bundle shipped without them is never stale.
+    :param xp_file:
+    :param json_file:
+    :param bundle_file:
+    :return:
+    """
+    try:
+        with open(bundle_file, 'rb') as f:
+            header = f.read(HEADER.size)
+    except OSError:
+        return True
+    if len(header) < HEADER.size:
+        return True
+    magic, version, xp_mtime, json_mtime, *_ = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        return True
+    for source, built in zip(source_mtimes(xp_file, json_file),
+                             (xp_mtime, json_mtime)):
+        if source and source != built:
+            return True
+    return False
+
+
+class BundleAtlas:
+    """
+    An Atlas that reads elements from a bundle
+
+    Has the same `elements` and `get_element` as bear_hug's Atlas, but
+    elements are described by (xsize, ysize, first cell) instead of their
+    position in the image.
+    """
+    def __init__(self, bundle_file):
+        self.source = bundle_file
+        with open(bundle_file, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, _, element_count, string_count, cells_offset = \
+            HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{} is not a version {} bundle'.format(
+                bundle_file, VERSION))
+        strings = []
+        offset = HEADER.size
+        for _ in range(string_count):
+            length, = STRING_LENGTH.unpack_from(self.mmap, offset)
+            offset += STRING_LENGTH.size
+            strings.append(
+                self.mmap[offset:offset + length].decode('utf-8'))
+            offset += length
+        self.palette = strings[element_count:]
+        table = np.frombuffer(self.mmap, dtype=ELEMENT, count=element_count,
+                              offset=offset)
+        self.elements = {name: tuple(int(x) for x in row)
+                         for name, row in zip(strings, table.tolist())}
+        self.cells = np.frombuffer(self.mmap, dtype=CELL,
+                                   offset=cells_offset).reshape((-1, 2))
+
+    def get_element(self, name):
+        """
+        Return an element with a given name
+
+        Raises KeyError if there is no such element.
+        :param name:
+        :return: chars, colors (2 2-nested lists)
+        """
+        xsize, ysize, start = self.elements[name]
+        block = self.cells[start:start + xsize * ysize].reshape(
+            (ysize, xsize, 2)).tolist()
+        chars = [[self.palette[cell[0]] for cell in row] for row in block]
+        colors = [[self.palette[cell[1]] for cell in row] for row in block]
+        return chars, colors
+
+
+def load_atlas(xp_file, json_file, bundle_file):
+    """
+    Return an atlas, rebuilding the bundle first if it's stale
+
+    If the bundle can't be written (eg a read-only install), the sources are
+    loaded the slow way instead.
+    :param xp_file:
+    :param json_file:
+    :param bundle_file:
+    :return: BundleAtlas or bear_hug Atlas
+    """
+    if is_stale(xp_file, json_file, bundle_file):
+        try:
+            build_bundle(xp_file, json_file, bundle_file)
+        except OSError:
+            from bear_hug.resources import XpLoader, Atlas
+            return Atlas(XpLoader(xp_file), json_file)
+    return BundleAtlas(bundle_file)
+
+
+if __name__ == '__main__':
+    # Offline step for the packaged builds:
+    # `bundle.py [xp_file json_file bundle_file]`
+    if len(sys.argv) > 1:
+        build_bundle(*sys.argv[1:4])
+    else:
+        build_bundle('indirectris.xp', 'indirectris.json',
+                     'indirectris.bundle')
@@ -13,6 +13,12 @@ class ScoreCounter(Label):
         super().__init__('00000', color='#ff0000ff', *kwargs)
         self.score = 0
     
+    def set_score(self, score):
+        self.score = score
+        self.text = str(self.score).rjust(5, '0')
+        if self.parent is self.terminal:
+            self.terminal.update_widget(self, refresh=False)
+    
     def on_event(self, event):
         if event.event_type in ('h7', 'v7'):
             self.score += 10
@@ -0,0 +1,1703 @@
+"""
+Headless game engine
+
+All the game rules, without terminal, window or sound. The bear_hug front end
+(gravity.py widgets and indirectris.py) is one consumer of these classes;
+Simulation is another, which runs the whole game on a plain board with a fixed
+timestep.
+"""
+
+from collections import namedtuple
+import copy
+from functools import lru_cache
+import threading
+import numpy as np
+import random
+from storage import ChunkedGrid
+Gravcell = namedtuple('Gravcell', ('ax', 'ay'))
+# Has the same fields as BearEvent, so the front end can convert them easily
+Event = namedtuple('Event', ('event_type', 'event_value'))
+
+# The board size. Everything else is laid out relative to it, see board_layout
+BOARD_SIZE = (60, 45)
+# Boards with more cells than this use chunked storage by default
+CHUNKED_AREA = 1 << 20
+# and the game rebuilds the field on a worker thread on boards larger than this
+ASYNC_FIELD_AREA = 1 << 16
+ATTRACTOR_MASS = 150
+# Emitter speed along the edges, cells per second, as (x, y)
+EMITTER_SPEED = (25, 25)
+# Figures are launched with a velocity that would take them to the target in
+# this many seconds, if there were no gravity. The number is empirical
+LAUNCH_TIME = 7
+# Physics tick length, in seconds
+TIMESTEP = 1 / 30
+# If True, figures move as many cells per tick as their velocity takes them,
+# rather than at most one per axis, so that their speed doesn't depend on the
+# tick length. Longer ticks need it
+SWEPT_MOVEMENT = False
+START_FIGURE = [' * ',
+                '***',
+                ' * ']
+SCORES = {'h7': 10, 'v7': 10, 'square': 15}
+# Figure chars as they are in the atlas, in the same order, so that the same
+# RNG state picks the same figures. For the rules, only spaces matter
+FIGURES = {'f_Ih': ['◙◘◘◙'],
+           'f_Iv': ['◙', '◘', '◘', '◙'],
+           'f_O': ['╔╗', '╚╝'],
+           'f_J1': ['◙◘◙', '  ◙'],
+           'f_J2': ['◙  ', '◙◘◙'],
+           'f_J3': ['◙◙', '◘ ', '◙ '],
+           'f_J4': [' ◙', ' ◘', '◙◙'],
+           'f_Zh': ['◙◙ ', ' ◙◙'],
+           'f_Zv': [' ◙', '◙◙', '◙ '],
+           'f_Sh': [' ◙◙', '◙◙ '],
+           'f_Sv': ['◙ ', '◙◙', ' ◙'],
+           'f_T1': [' ◙ ', '◙◙◙'],
+           'f_T2': ['◙ ', '◙◙', '◙ '],
+           'f_T3': [' ◙', '◙◙', ' ◙'],
+           'f_T4': ['◙◙◙', ' ◙ '],
+           'f_L1': ['◙◘◙', '◙  '],
+           'f_L2': ['  ◙', '◙◘◙'],
+           'f_L3': ['◙ ', '◘ ', '◙◙'],
+           'f_L4': ['◙◙', ' ◘', ' ◙']}
+
+
+def attractor_field(size, mass, center):
+    """
+    Calculate the field of a single mass over the whole grid
+    
+    :param size: tuple of ints (xsize, ysize)
+    :param mass: attractor mass
+    :param center: (x, y) of the mass center. Doesn't have to be on the grid
+    :return: Gravcell of two (xsize, ysize) arrays
+    """
+    # x is a column and y is a row, so that together they broadcast to the
+    # whole grid
+    return point_field(mass, center,
+                       np.arange(size[0], dtype=float)[:, None],
+                       np.arange(size[1], dtype=float)[None, :])
+
+
+def point_field(mass, center, xs, ys):
+    """
+    Calculate the field of a single mass at given points
+    
+    :param mass: attractor mass
+    :param center: (x, y) of the mass center
+    :param xs: array of x coordinates
+    :param ys: array of y coordinates, broadcastable with xs
+    :return: Gravcell of two arrays
+    """
+    # Distances from the mass center along each axis
+    dx = xs - center[0]
+    dy = ys - center[1]
+    dist_3 = np.sqrt(dx ** 2 + dy ** 2) ** 3
+    # The mass center itself has zero distance and gets no acceleration
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a_x = np.where(dx != 0, -mass * dx / dist_3, 0.0)
+        a_y = np.where(dy != 0, -mass * dy / dist_3, 0.0)
+    return Gravcell(a_x, a_y)
+
+
+@lru_cache(maxsize=16)
+def gravity_kernel(size, mass):
+    """
+    A field of a given mass on a grid twice the size of the board
+    
+    The mass center is at (xsize, ysize), so any attractor whose center is
+    within the board gets its field as a board-sized window of this kernel.
+    The kernels are cached and shared, so they are made read-only.
+    :param size: tuple of ints (xsize, ysize) of the *board*
+    :param mass: attractor mass
+    :return: Gravcell of two (2*xsize, 2*ysize) arrays
+    """
+    kernel = attractor_field((size[0] * 2, size[1] * 2), mass, size)
+    kernel.ax.flags.writeable = False
+    kernel.ay.flags.writeable = False
+    return kernel
+
+
+def mass_field(size, mass, center):
+    """
+    Return the field of a single mass over the board
+    
+    Normally it's just a read-only view into the cached kernel for this
+    mass, so nothing is calculated.
+    :param size: tuple of ints (xsize, ysize)
+    :param mass: attractor mass
+    :param center: (x, y) of the mass center
+    :return: Gravcell of two (xsize, ysize) arrays
+    """
+    if 0 <= center[0] <= size[0] and 0 <= center[1] <= size[1]:
+        kernel = gravity_kernel(tuple(size), mass)
+        # Kernel cell (x - center + size) is the board cell x
+        x0 = size[0] - center[0]
+        y0 = size[1] - center[1]
+        return Gravcell(kernel.ax[x0:x0 + size[0], y0:y0 + size[1]],
+                        kernel.ay[x0:x0 + size[0], y0:y0 + size[1]])
+    # Mass center is off the board and the window won't fit
+    return attractor_field(size, mass, center)
+
+
+def fft_length(n):
+    """
+    Return the smallest number >= n that has no prime factors above 5
+    
+    FFTs of such lengths are the fastest.
+    :param n:
+    :return:
+    """
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
+@lru_cache(maxsize=4)
+def kernel_spectrum(size):
+    """
+    The Fourier transform of the unit mass kernel, padded so that the circular
+    convolution gives the correct field over the whole board
+    
+    :param size: tuple of ints (xsize, ysize) of the board
+    :return: Gravcell of two rfft2 arrays
+    """
+    kernel = gravity_kernel(tuple(size), 1)
+    shape = (fft_length(2 * size[0] + 1), fft_length(2 * size[1] + 1))
+    return Gravcell(np.fft.rfft2(kernel.ax, shape),
+                    np.fft.rfft2(kernel.ay, shape))
+
+
+def fft_field(size, masses):
+    """
+    Calculate the summed field of many masses as a convolution
+    
+    The masses are put on a density grid, which is convolved with the unit
+    mass kernel via FFT. The cost doesn't depend on the number of masses, but
+    the result is only equal to the direct sum up to rounding errors.
+    :param size: tuple of ints (xsize, ysize)
+    :param masses: iterable of (mass, (x, y)) with mass centers within
+    [0, xsize] and [0, ysize]
+    :return: Gravcell of two (xsize, ysize) arrays
+    """
+    spectrum = kernel_spectrum(tuple(size))
+    shape = (fft_length(2 * size[0] + 1), fft_length(2 * size[1] + 1))
+    density = np.zeros(shape)
+    for mass, center in masses:
+        density[center] += mass
+    density = np.fft.rfft2(density)
+    # The kernel has the mass center at (xsize, ysize), so the board starts
+    # there in the convolution
+    window = (slice(size[0], 2 * size[0]), slice(size[1], 2 * size[1]))
+    return Gravcell(np.fft.irfft2(density * spectrum.ax, shape)[window],
+                    np.fft.irfft2(density * spectrum.ay, shape)[window])
+
+
+def field_sum(size, masses, solver='direct', abandon=None):
+    """
+    Calculate the summed field of many masses from scratch
+    
+    :param size: tuple of ints (xsize, ysize)
+    :param masses: list of (mass, (x, y) of the mass center)
+    :param solver: 'direct' adds up every mass' field, 'fft' uses
+    `fft_field` for the masses on the board
+    :param abandon: a function of the number of masses summed so far, called
+    before each mass (and before the FFT pass, which sums all the masses on
+    the board at once). If it returns True, the calculation is dropped
+    :return: Gravcell of two new (xsize, ysize) arrays, or None if abandoned
+    """
+    done = 0
+    if solver == 'fft':
+        # Masses centered off the board can't be put on the density grid
+        inside = []
+        outside = []
+        for mass, center in masses:
+            if 0 <= center[0] <= size[0] and 0 <= center[1] <= size[1]:
+                inside.append((mass, center))
+            else:
+                outside.append((mass, center))
+        if abandon and abandon(0):
+            return None
+        r = fft_field(size, inside)
+        done = len(inside)
+        masses = outside
+    else:
+        r = Gravcell(np.zeros(size), np.zeros(size))
+    for i, (mass, center) in enumerate(masses, done):
+        if abandon and abandon(i):
+            return None
+        field = mass_field(size, mass, center)
+        np.add(r.ax, field.ax, out=r.ax)
+        np.add(r.ay, field.ay, out=r.ay)
+    return r
+
+
+class FieldColumn:
+    """
+    A single x-column of the field.
+    
+    Exists only so that ``field[x][y].ax`` lookups keep working on top of the
+    array storage.
+    """
+    __slots__ = ('ax', 'ay')
+    
+    def __init__(self, ax, ay):
+        self.ax = ax
+        self.ay = ay
+    
+    def __getitem__(self, item):
+        return Gravcell(float(self.ax[item]), float(self.ay[item]))
+
+
+class GravityField:
+    """
+    A gravity field that contains multiple attractors
+    
+    Both the sum field and every attractor's field are stored as a
+    Gravcell of two (xsize, ysize) float arrays, so that ``ax[x, y]`` is
+    the acceleration in a given cell.
+    
+    There are two solvers. 'direct' keeps every attractor's field and updates
+    the sum by the difference when one moves, which is exact and the fastest
+    for a few attractors. 'fft' keeps no per-attractor fields and calculates
+    the whole sum at once with `fft_field`, which costs the same for any
+    number of attractors; it's meant for boards with lots of them, moved
+    many at a time.
+    """
+    def __init__(self, size, lazy=False, solver='direct'):
+        """
+        
+        :param size: tuple of ints (xsize, ysize)
+        :param lazy: if True, moving an attractor only marks it dirty, and the
+        field is updated once when it is next looked up. This way several
+        moves within a tick cost a single update.
+        :param solver: 'direct' or 'fft'
+        """
+        if solver not in ('direct', 'fft'):
+            raise ValueError('Unknown field solver {}'.format(solver))
+        self.size = size
+        self.lazy = lazy
+        self.solver = solver
+        self.sum_field = Gravcell(np.zeros(size), np.zeros(size))
+        self.attractor_fields = {}
+        self.positions = {}
+        # Attractors moved since the last update. A dict is used as an ordered
+        # set, so that the fields are always summed in the same order
+        self.dirty = {}
+        # Changes every time an attractor is added or moved
+        self.version = 0
+        
+    def add_attractor(self, attractor, pos):
+        """
+        Add an attractor
+        :param attractor: anything with `mass` and `mass_center` attributes,
+        eg gravity.Attractor widget or engine.Mass
+        :return:
+        """
+        self.positions[attractor] = pos
+        self.version += 1
+        if self.solver == 'fft':
+            self.dirty[attractor] = True
+            if not self.lazy:
+                self.update()
+        else:
+            self.rebuild_attractor_field(attractor)
+            self.rebuild_sum_field()
+        
+    def move_attractor(self, attractor, pos):
+        self.positions[attractor] = pos
+        self.version += 1
+        if self.lazy:
+            self.dirty[attractor] = True
+        elif self.solver == 'fft':
+            self.dirty[attractor] = True
+            self.update()
+        else:
+            self.update_attractor(attractor)
+    
+    def update_attractor(self, attractor):
+        """
+        Rebuild the attractor's field and update the sum field in place
+        
+        Only the old and the new field of this attractor are touched, so the
+        cost doesn't depend on how many other attractors there are.
+        :param attractor:
+        :return:
+        """
+        old = self.attractor_fields[attractor]
+        self.rebuild_attractor_field(attractor)
+        new = self.attractor_fields[attractor]
+        for total, old_a, new_a in zip(self.sum_field, old, new):
+            np.subtract(total, old_a, out=total)
+            np.add(total, new_a, out=total)
+    
+    def update(self):
+        """
+        Apply all the moves made since the last update
+        :return:
+        """
+        if self.solver == 'fft':
+            self.rebuild_sum_field()
+        else:
+            for attractor in self.dirty:
+                self.update_attractor(attractor)
+        self.dirty.clear()
+    
+    def rebuild_attractor_field(self, attractor):
+        """
+        Rebuild the attractor's field
+        
+        Normally it's just a view into the cached kernel for this mass, so
+        nothing is calculated.
+        :param attractor:
+        :return:
+        """
+        center = (self.positions[attractor][0] + attractor.mass_center[0],
+                  self.positions[attractor][1] + attractor.mass_center[1])
+        self.attractor_fields[attractor] = mass_field(self.size,
+                                                      attractor.mass, center)
+            
+    def rebuild_sum_field(self):
+        """
+        Rebuild sum field as a sum of attractor fields
+        :return:
+        """
+        if self.solver == 'fft':
+            self.solve_fft()
+            return
+        self.sum_field.ax.fill(0)
+        self.sum_field.ay.fill(0)
+        for field in self.attractor_fields.values():
+            np.add(self.sum_field.ax, field.ax, out=self.sum_field.ax)
+            np.add(self.sum_field.ay, field.ay, out=self.sum_field.ay)
+    
+    def masses(self):
+        """
+        Return (mass, mass center) of every attractor
+        :return:
+        """
+        return [(attractor.mass, (pos[0] + attractor.mass_center[0],
+                                  pos[1] + attractor.mass_center[1]))
+                for attractor, pos in self.positions.items()]
+    
+    def solve_fft(self):
+        """
+        Calculate the sum field with `fft_field`
+        :return:
+        """
+        field = field_sum(self.size, self.masses(), solver='fft')
+        np.copyto(self.sum_field.ax, field.ax)
+        np.copyto(self.sum_field.ay, field.ay)
+    
+    def restore(self, positions, sum_field):
+        """
+        Put attractors at given positions, with a precalculated sum field
+        
+        Nothing is calculated: attractor fields are views into the cached
+        kernels anyway, and the sum is copied in. The sum must be the one
+        these positions give, eg from an earlier `sum_field`.
+        :param positions: dict of attractors to positions
+        :param sum_field: Gravcell of two (xsize, ysize) arrays
+        :return:
+        """
+        self.positions.update(positions)
+        if self.solver == 'direct':
+            for attractor in positions:
+                self.rebuild_attractor_field(attractor)
+        np.copyto(self.sum_field.ax, sum_field.ax)
+        np.copyto(self.sum_field.ay, sum_field.ay)
+        self.dirty.clear()
+        self.version += 1
+    
+    def peek(self):
+        """
+        Return the field as it will be after the next update, without
+        updating this one
+        
+        An update changes the sum field by the difference of the attractor's
+        old and new fields, so its exact result depends on when it happens.
+        Anything that only looks at the field (like the trajectory preview)
+        uses this to leave the game's own updates where they were.
+        :return: GravityField
+        """
+        if not self.dirty:
+            return self
+        r = copy.copy(self)
+        r.sum_field = Gravcell(self.sum_field.ax.copy(),
+                               self.sum_field.ay.copy())
+        r.attractor_fields = dict(self.attractor_fields)
+        r.dirty = dict(self.dirty)
+        r.update()
+        return r
+    
+    def sample(self, xs, ys):
+        """
+        Look up the field in many cells at once
+        :param xs: array of x coordinates
+        :param ys: array of y coordinates
+        :return: Gravcell of two arrays
+        """
+        if self.dirty:
+            self.update()
+        # sum_field is read once, in case another thread replaces it
+        field = self.sum_field
+        return Gravcell(field.ax[xs, ys], field.ay[xs, ys])
+    
+    def materialize(self):
+        """
+        Return the whole sum field, up to date
+        
+        Some fields don't keep all of it all the time, so this is the way to
+        get the full grid, eg for overlays.
+        :return: Gravcell of two (xsize, ysize) arrays. Not a copy
+        """
+        return self.peek().sum_field
+    
+    def close(self):
+        """
+        Release whatever the field holds. A plain field holds nothing
+        :return:
+        """
+        pass
+    
+    def __getitem__(self, item):
+        # List API for ease of lookup
+        if self.dirty:
+            self.update()
+        field = self.sum_field
+        return FieldColumn(field.ax[item], field.ay[item])
+
+
+class AsyncGravityField(GravityField):
+    """
+    A GravityField that is rebuilt on a worker thread
+    
+    Moving an attractor only records the new position and wakes the worker,
+    which calculates the whole sum field from scratch into a new buffer and
+    swaps it in when it's done. Until then, figures keep using the last
+    complete field. Moves made during a rebuild are collapsed into the next
+    one, and a rebuild that was overtaken by a move is abandoned at the next
+    mass (or before the FFT pass) and started over with the new positions. A
+    rebuild that got to the end is swapped in even if it was overtaken.
+    
+    Numpy releases the GIL for the array arithmetic, so the game thread isn't
+    held up by a rebuild. The downside is that when exactly the field
+    changes depends on timing, so the game is not deterministic with it.
+    """
+    def __init__(self, size, solver='direct'):
+        super().__init__(size, solver=solver)
+        self.condition = threading.Condition()
+        # Number of the last requested rebuild, and of the one in sum_field
+        self.requested = 0
+        self.built = 0
+        # Bumped by every restore, so that a rebuild started before one is
+        # thrown away instead of overwriting the restored field
+        self.generation = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+    
+    def add_attractor(self, attractor, pos):
+        # Attractors are added when the game is set up, so it can wait
+        self.move_attractor(attractor, pos)
+        self.wait()
+    
+    def move_attractor(self, attractor, pos):
+        with self.condition:
+            self.positions[attractor] = pos
+            self.version += 1
+            self.requested += 1
+            self.condition.notify_all()
+    
+    def update(self):
+        # Rebuilds happen in the worker
+        pass
+    
+    def restore(self, positions, sum_field):
+        with self.condition:
+            self.positions.update(positions)
+            self.sum_field = Gravcell(sum_field.ax.copy(), sum_field.ay.copy())
+            # Counts as a finished rebuild
+            self.requested += 1
+            self.built = self.requested
+            self.generation += 1
+            self.version += 1
+            self.condition.notify_all()
+    
+    def wait(self):
+        """
+        Block until the field includes all the moves made so far
+        :return:
+        """
+        with self.condition:
+            while self.built != self.requested and not self.closed:
+                self.condition.wait()
+    
+    def materialize(self):
+        # The last swapped in field may be of older positions, and whoever
+        # wants the whole grid (eg a snapshot) needs it to match them
+        self.wait()
+        return self.sum_field
+    
+    def work(self):
+        while True:
+            with self.condition:
+                while self.built == self.requested and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                request = self.requested
+                generation = self.generation
+                masses = self.masses()
+            # A move made since the rebuild started supersedes it
+            field = field_sum(self.size, masses, solver=self.solver,
+                              abandon=lambda i: self.requested != request)
+            if field is None:
+                continue
+            with self.condition:
+                if self.generation != generation:
+                    continue
+                self.sum_field = field
+                self.built = request
+                # The field has changed for anyone who cached anything
+                self.version += 1
+                self.condition.notify_all()
+    
+    def close(self):
+        """
+        Stop the worker thread
+        :return:
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+
+class OnDemandColumn:
+    """
+    A single x-column of an OnDemandGravityField
+    """
+    __slots__ = ('field', 'x')
+    
+    def __init__(self, field, x):
+        self.field = field
+        self.x = x
+    
+    def __getitem__(self, item):
+        field = self.field
+        if field.stamps[self.x, item] != field.configuration:
+            field.calculate(np.array([self.x]), np.array([item]))
+        return Gravcell(float(field.sum_field.ax[self.x, item]),
+                        float(field.sum_field.ay[self.x, item]))
+
+
+class OnDemandGravityField(GravityField):
+    """
+    A GravityField that only calculates the cells that are looked up
+    
+    Figures only ever look up the few cells they pass between attractor
+    moves, so instead of updating the whole grid after every move, a cell's
+    sum is calculated when it's first looked up and memoized until the
+    attractors move again. The memo is the sum_field arrays themselves, plus
+    a stamp per cell telling which attractor configuration its value is for.
+    A move only starts a new configuration, so it costs nothing however big
+    the board is.
+    
+    Cells are summed over the attractors in the order they were added, so
+    their values are exactly what a from-scratch direct rebuild would give.
+    `materialize` fills in the rest of the grid.
+    """
+    def __init__(self, size):
+        super().__init__(size)
+        self.stamps = np.zeros(size, dtype=np.int64)
+        # Stamps start at 0, which is never current
+        self.configuration = 1
+    
+    def add_attractor(self, attractor, pos):
+        self.move_attractor(attractor, pos)
+    
+    def move_attractor(self, attractor, pos):
+        self.positions[attractor] = pos
+        self.version += 1
+        self.configuration += 1
+    
+    def update(self):
+        # Nothing is calculated until it's looked up
+        pass
+    
+    def calculate(self, xs, ys):
+        """
+        Calculate and memoize the sum in given cells
+        :param xs: array of x coordinates
+        :param ys: array of y coordinates
+        :return:
+        """
+        ax = np.zeros(len(xs))
+        ay = np.zeros(len(xs))
+        for attractor, pos in self.positions.items():
+            field = point_field(attractor.mass,
+                                (pos[0] + attractor.mass_center[0],
+                                 pos[1] + attractor.mass_center[1]),
+                                xs.astype(float), ys.astype(float))
+            np.add(ax, field.ax, out=ax)
+            np.add(ay, field.ay, out=ay)
+        self.sum_field.ax[xs, ys] = ax
+        self.sum_field.ay[xs, ys] = ay
+        self.stamps[xs, ys] = self.configuration
+    
+    def sample(self, xs, ys):
+        missing = self.stamps[xs, ys] != self.configuration
+        if missing.any():
+            self.calculate(xs[missing], ys[missing])
+        return Gravcell(self.sum_field.ax[xs, ys], self.sum_field.ay[xs, ys])
+    
+    def materialize(self):
+        xs, ys = np.nonzero(self.stamps != self.configuration)
+        if len(xs):
+            self.calculate(xs, ys)
+        return self.sum_field
+    
+    def restore(self, positions, sum_field):
+        self.positions.update(positions)
+        np.copyto(self.sum_field.ax, sum_field.ax)
+        np.copyto(self.sum_field.ay, sum_field.ay)
+        self.version += 1
+        self.configuration += 1
+        self.stamps.fill(self.configuration)
+    
+    def __getitem__(self, item):
+        return OnDemandColumn(self, item)
+
+
+def figure_mask(chars):
+    """
+    Pack figure chars into row masks
+    
+    :param chars: figure chars, either a list of lists or a list of strings
+    :return: tuple of ints, one per row, with bit x set for every non-space
+    char
+    """
+    return tuple(sum(1 << x for x, char in enumerate(row) if char != ' ')
+                 for row in chars)
+
+
+# Row masks of every atlas figure
+FIGURE_MASKS = {name: figure_mask(chars) for name, chars in FIGURES.items()}
+
+BoardLayout = namedtuple('BoardLayout', ('attractors', 'emitter', 'start',
+                                         'target'))
+
+
+def board_layout(size=BOARD_SIZE):
+    """
+    Initial positions of things on a board of a given size
+    
+    Shared by init_game and Simulation, so that headless games start exactly
+    like the real ones. The positions are scaled from the original 60x45
+    layout, and on a 60x45 board they are exactly the original ones.
+    :param size: tuple of ints (xsize, ysize)
+    :return: BoardLayout of attractor positions, emitter position, position of
+    the building's start and the point towards which figures are launched
+    """
+    return BoardLayout(attractors=((size[0] // 6, size[1] * 5 // 9),
+                                   (size[0] * 5 // 6, size[1] * 5 // 9)),
+                       emitter=(max(size[0] - 20, 0), size[1] - 5),
+                       start=(size[0] // 2 - 1, size[1] // 2 - 2),
+                       target=(size[0] // 2, (size[1] + 1) // 2))
+
+
+class TetrisColumn:
+    """
+    A single x-column of the board
+    
+    Returned by ``tetris[x]``, so that ``tetris[x][y] = 1`` goes through
+    TetrisSystem.set_cell and keeps the row masks in sync.
+    """
+    __slots__ = ('tetris', 'x')
+    
+    def __init__(self, tetris, x):
+        self.tetris = tetris
+        self.x = x
+    
+    def __getitem__(self, item):
+        return int(self.tetris.cells[self.x, item])
+    
+    def __setitem__(self, key, value):
+        self.tetris.set_cell(self.x, key, value)
+    
+    def __len__(self):
+        return self.tetris.size[1]
+
+
+class TetrisSystem:
+    """
+    All the tetris logic
+    
+    Cell can contain either zero (can move), 1 (should stop and all the moved
+    cells become 1) or 2 (should stop and moved element should be destroyed,
+    eg with screen edges or attractor centers).
+    2 takes precedence over 1
+    
+    The cells are a (xsize, ysize) byte array. Besides them, the board is
+    kept as two lists of row masks, `installed` and `destroy`, with bit x of
+    the y-th element set if cell (x, y) is 1 or 2, respectively. Collisions are
+    checked against those.
+    """
+    def __init__(self, size, chunked=None):
+        """
+        
+        :param size: tuple of ints (xsize, ysize)
+        :param chunked: if True, cells are stored in a ChunkedGrid, so that
+        only the chunks with something in them are allocated. By default,
+        boards larger than CHUNKED_AREA cells are chunked
+        """
+        self.size = size
+        if chunked is None:
+            chunked = size[0] * size[1] > CHUNKED_AREA
+        if chunked:
+            self.cells = ChunkedGrid(size)
+        else:
+            self.cells = np.zeros(size, dtype=np.uint8)
+        self.installed = [0 for y in range(size[1])]
+        self.destroy = [0 for y in range(size[1])]
+        for x in range(size[0]):
+            self.set_cell(x, 0, 2)
+            self.set_cell(x, size[1]-1, 2)
+        for y in range(2, size[1]-1):
+            self.set_cell(0, y, 2)
+            self.set_cell(size[0]-1, y, 2)
+    
+    def set_cell(self, x, y, value):
+        # Negative indices work like they do for lists
+        if x < 0:
+            x += self.size[0]
+        if y < 0:
+            y += self.size[1]
+        self.cells[x, y] = value
+        bit = 1 << x
+        if value == 1:
+            self.installed[y] |= bit
+        else:
+            self.installed[y] &= ~bit
+        if value == 2:
+            self.destroy[y] |= bit
+        else:
+            self.destroy[y] &= ~bit
+    
+    def check_move(self, pos, chars, mask=None):
+        """
+        Check whether the figure can be placed at a given position
+        
+        :param pos: figure position
+        :param chars: figure chars
+        :param mask: figure's row masks, as returned by `figure_mask`. If not
+        set, it is calculated from chars
+        :return: 0 if the figure fits, otherwise the value of a cell it
+        collides with
+        """
+        if mask is None:
+            mask = figure_mask(chars)
+        x, y = pos
+        if x < 0 or y < 0 or x + len(chars[0]) > self.size[0] or \
+                y + len(mask) > self.size[1]:
+            # Partially out of the board; leave that to the cellwise check
+            return self.check_move_cells(pos, chars)
+        installed = self.installed
+        destroy = self.destroy
+        hit_1 = 0
+        hit_2 = 0
+        for row in mask:
+            row <<= x
+            hit_1 |= installed[y] & row
+            hit_2 |= destroy[y] & row
+            y += 1
+        if hit_1 and hit_2:
+            # The result depends on which of them is met first
+            return self.check_move_cells(pos, chars)
+        elif hit_1:
+            return 1
+        elif hit_2:
+            return 2
+        return 0
+    
+    def check_move_cells(self, pos, chars):
+        """
+        Check the move cell by cell
+        
+        Slow, but it's how check_move is defined.
+        :param pos: figure position
+        :param chars: figure chars
+        :return:
+        """
+        for x_offset in range(len(chars[0])):
+            for y_offset in range(len(chars)):
+                c = self.cells[pos[0]+x_offset, pos[1] + y_offset]
+                if c > 0 and chars[y_offset][x_offset] != ' ':
+                    return int(c)
+        return 0
+    
+    def contact_cell(self, pos, chars):
+        """
+        Return the board cell a figure at a given position collides with
+        
+        Cells are checked in the same order as in check_move_cells, so it's
+        the cell whose value check_move returns.
+        :param pos: figure position
+        :param chars: figure chars
+        :return: (x, y), or None if the figure fits
+        """
+        for x_offset in range(len(chars[0])):
+            for y_offset in range(len(chars)):
+                c = self.cells[pos[0]+x_offset, pos[1] + y_offset]
+                if c > 0 and chars[y_offset][x_offset] != ' ':
+                    return pos[0] + x_offset, pos[1] + y_offset
+        return None
+    
+    def install(self, pos, chars):
+        """
+        Set cells to 1 wherever the figure has a non-space char
+        :param pos: figure position
+        :param chars: figure chars
+        :return:
+        """
+        for x_offset in range(len(chars[0])):
+            for y_offset in range(len(chars)):
+                if chars[y_offset][x_offset] != ' ':
+                    self.set_cell(pos[0]+x_offset, pos[1]+y_offset, 1)
+    
+    def check_for_removal(self, pos=None, size=None):
+        """
+        Check if something is to be removed
+        
+        Without arguments, the whole board is scanned. After an installation,
+        though, only the patterns that include the new figure's cells may have
+        appeared: everything else was already removed by the previous check.
+        So if the figure's position and size are given, only the corners of
+        the lines and squares overlapping it are checked. Either way, corners
+        are checked in the same order and the result is the same.
+        :param pos: position of the last installed figure
+        :param size: (width, height) of the last installed figure
+        :return: list of Events
+        """
+        # Return events, so this is expected to be called by FigureManager's
+        # on_event. Later BuildingWidget will catch the event and update itself
+        # accordingly. Sounds are up to the front end
+        r = []
+        if pos is None:
+            # Only corners that had a complete pattern before anything was
+            # removed can have one now, as cells are never set here
+            corners = sorted(set(e.event_value for e in self.find_patterns()))
+            for x, y in corners:
+                r += self.check_corner(x, y)
+            return r
+        # Lines reach up to 6 cells right and down from the corner
+        x_range = range(max(pos[0]-6, 0),
+                        min(pos[0]+size[0], self.size[0]-3))
+        y_range = range(max(pos[1]-6, 0),
+                        min(pos[1]+size[1], self.size[1]-3))
+        for x in x_range:
+            for y in y_range:
+                r += self.check_corner(x, y)
+        return r
+    
+    def find_patterns(self):
+        """
+        Find all the lines and squares on the board, without removing anything
+        
+        Builds a summed-area table of the installed cells, so that every
+        window is checked in constant time, and all windows of a given shape
+        are checked at once. Overlapping patterns are all reported. Chunked
+        boards are processed one allocated chunk at a time.
+        :return: list of Events, ordered the same way check_for_removal
+        would emit them
+        """
+        # Only the corners check_for_removal visits
+        xmax = self.size[0] - 3
+        ymax = self.size[1] - 3
+        if isinstance(self.cells, ChunkedGrid):
+            # Corners of the patterns are 1s, so only allocated chunks
+            # can have any
+            c = self.cells.chunk
+            blocks = [(kx * c, ky * c, c, c) for kx, ky in self.cells.chunks]
+        else:
+            blocks = [(0, 0, self.size[0], self.size[1])]
+        found = []
+        for x0, y0, block_w, block_h in blocks:
+            # Patterns starting in the block may reach 6 cells past it
+            if isinstance(self.cells, ChunkedGrid):
+                occupied = self.cells.region(x0, y0, block_w + 6,
+                                             block_h + 6) == 1
+            else:
+                occupied = self.cells[x0:x0 + block_w + 6,
+                                      y0:y0 + block_h + 6] == 1
+            # table[x, y] is the number of 1s with both coordinates less
+            # than x, y
+            table = np.zeros((occupied.shape[0]+1, occupied.shape[1]+1),
+                             dtype=np.int32)
+            table[1:, 1:] = occupied.cumsum(0).cumsum(1)
+            for order, event_type, w, h in ((0, 'h7', 7, 1),
+                                            (1, 'v7', 1, 7),
+                                            (2, 'square', 3, 3)):
+                sums = table[w:, h:] - table[:-w, h:] - table[w:, :-h] + \
+                    table[:-w, :-h]
+                xs, ys = np.nonzero(
+                    sums[:min(block_w, xmax - x0), :min(block_h, ymax - y0)]
+                    == w * h)
+                found += [(int(x) + x0, int(y) + y0, order, event_type)
+                          for x, y in zip(xs, ys)]
+        found.sort()
+        return [Event(event_type=event_type, event_value=(x, y))
+                for x, y, order, event_type in found]
+    
+    def check_corner(self, x, y):
+        """
+        Remove any lines and squares with a top left corner at (x, y)
+        :param x:
+        :param y:
+        :return: list of Events
+        """
+        r = []
+        installed = self.installed
+        if not installed[y] >> x & 1:
+            return r
+        if x <= self.size[0] - 7 and installed[y] >> x & 0x7f == 0x7f:
+            # Horizontal 7
+            for x_1 in range(7):
+                self.set_cell(x+x_1, y, 0)
+            r.append(Event(event_type='h7', event_value=(x, y)))
+        if y <= self.size[1] - 7 and \
+                all(installed[y+y_1] >> x & 1 for y_1 in range(1, 7)):
+            # Or a vertical 7. The corner itself is not checked, because h7
+            # may have already removed it
+            for y_1 in range(1, 7):
+                self.set_cell(x, y+y_1, 0)
+            r.append(Event(event_type='v7', event_value=(x, y)))
+        if all(installed[y+y_1] >> x & 7 == 7 for y_1 in range(3)):
+            for x_1 in range(3):
+                for y_1 in range(3):
+                    self.set_cell(x+x_1, y+y_1, 0)
+            r.append(Event(event_type='square', event_value=(x, y)))
+        return r
+    
+    def copy(self):
+        """
+        Return an independent copy of the board
+        :return:
+        """
+        r = TetrisSystem.__new__(TetrisSystem)
+        r.size = self.size
+        r.cells = self.cells.copy()
+        r.installed = list(self.installed)
+        r.destroy = list(self.destroy)
+        return r
+    
+    def __getitem__(self, item):
+        return TetrisColumn(self, item)
+
+
+def swept_cells(pos, vx, vy, x_covered, y_covered, dt):
+    """
+    Iterate over the positions a figure passes in dt, in order
+    
+    Along each axis, the figure enters the next cell whenever it has covered
+    a whole one, ie every 1/|v| seconds. If it enters the next cells along
+    both axes at the same moment, that's a single diagonal move, like in
+    Figure.step.
+    :param pos: figure position
+    :param vx: x velocity, cells per second
+    :param vy: y velocity, cells per second
+    :param x_covered: fraction of a cell already covered along x
+    :param y_covered: fraction of a cell already covered along y
+    :param dt: time, in seconds
+    :return: generator of positions
+    """
+    x, y = pos
+    x_cells = int(x_covered + abs(vx) * dt)
+    y_cells = int(y_covered + abs(vy) * dt)
+    i = j = 0
+    while i < x_cells or j < y_cells:
+        # Time of the next crossing along each axis
+        tx = (i + 1 - x_covered) / abs(vx) if i < x_cells else float('inf')
+        ty = (j + 1 - y_covered) / abs(vy) if j < y_cells else float('inf')
+        if tx <= ty:
+            x += 1 if vx > 0 else -1
+            i += 1
+        if ty <= tx:
+            y += 1 if vy > 0 else -1
+            j += 1
+        yield x, y
+
+
+def sweep(figure, vx, vy, x_covered, y_covered, dt, tetris, path=None):
+    """
+    Move a figure along `swept_cells` until it bumps into something
+    
+    Every position is checked against the board in order, so the figure
+    never jumps over anything, however fast it is. If it does bump into
+    something, it stays in the last free position and its `contact` is set
+    to the board cell it has hit.
+    :param figure: Figure. Its pos is updated, the rest is left to the caller
+    :param vx: x velocity, cells per second
+    :param vy: y velocity, cells per second
+    :param x_covered: see swept_cells
+    :param y_covered: see swept_cells
+    :param dt: time, in seconds
+    :param tetris: TetrisSystem
+    :param path: if a list, every free position passed is appended to it
+    :return: 0 if the figure hasn't bumped into anything, otherwise the value
+    of the cell it has bumped into
+    """
+    for pos in swept_cells(figure.pos, vx, vy, x_covered, y_covered, dt):
+        t = tetris.check_move(pos, figure.chars, figure.mask)
+        if t:
+            figure.contact = tetris.contact_cell(pos, figure.chars)
+            return t
+        figure.pos = pos
+        if path is not None:
+            path.append(pos)
+    return 0
+
+
+class Mass:
+    """
+    A bare attractor for headless games
+    
+    Anything with `mass` and `mass_center` can be put into a GravityField, this
+    is just the minimal such thing.
+    """
+    def __init__(self, mass=100, mass_center=(2, 2)):
+        self.mass = mass
+        self.mass_center = mass_center
+
+
+class Figure:
+    """
+    A flying figure: its chars, position and velocity
+    """
+    def __init__(self, chars, pos=(0, 0), vx=1, vy=1, mask=None):
+        """
+        
+        :param chars: figure chars
+        :param pos: position
+        :param vx: x velocity, cells per second
+        :param vy: y velocity, cells per second
+        :param mask: precalculated `figure_mask(chars)`, if any
+        """
+        self.chars = chars
+        if mask is None:
+            mask = figure_mask(chars)
+        self.mask = mask
+        self.reset(pos, vx, vy)
+    
+    def reset(self, pos=(0, 0), vx=1, vy=1):
+        """
+        Put the figure into the same state a new one would have
+        
+        Chars and mask stay the same, so a Figure can be reused instead of
+        creating a new one.
+        :param pos: position
+        :param vx: x velocity, cells per second
+        :param vy: y velocity, cells per second
+        :return:
+        """
+        self.pos = pos
+        self.vx = vx
+        self.vy = vy
+        # Delay between steps, in seconds
+        if self.vx != 0:
+            self.x_delay = abs(1/self.vx)
+        else:
+            self.x_delay = 0
+        if self.vy != 0:
+            self.y_delay = abs(1/self.vy)
+        else:
+            self.y_delay = 0
+        # How long since last step
+        self.x_waited = 0
+        self.y_waited = 0
+        # Fraction of a cell covered since the last step, for swept movement
+        self.x_covered = 0
+        self.y_covered = 0
+        # The board cell the figure has last bumped into, if swept
+        self.contact = None
+    
+    def step(self, dt, field, tetris, swept=False):
+        """
+        Accelerate the figure and move it by at most one cell along each axis
+        
+        :param dt: time since the previous step, in seconds
+        :param field: GravityField
+        :param tetris: TetrisSystem
+        :param swept: if True, `sweep` instead
+        :return: 0 if the figure has moved (or didn't need to), otherwise the
+        TetrisSystem cell value it has bumped into. In the latter case the
+        figure stays where it was.
+        """
+        if swept:
+            return self.sweep(dt, field, tetris)
+        self.x_waited += dt
+        self.y_waited += dt
+        xpos, ypos = self.pos
+        cell = field[xpos][ypos]
+        self.vx += cell.ax * dt
+        self.vy += cell.ay * dt
+        if self.vx != 0:
+            self.x_delay = abs(1 / self.vx)
+        if self.vy != 0:
+            self.y_delay = abs(1 / self.vy)
+        if self.x_waited >= self.x_delay and self.vx != 0:
+            new_x = xpos + round(self.vx/abs(self.vx))
+            self.x_waited = 0
+        else:
+            new_x = xpos
+        if self.y_waited >= self.y_delay and self.vy != 0:
+            new_y = ypos + round(self.vy/abs(self.vy))
+            self.y_waited = 0
+        else:
+            new_y = ypos
+        if new_x != xpos or new_y != ypos:
+            t = tetris.check_move((new_x, new_y), self.chars, self.mask)
+            if t == 0:
+                self.pos = (new_x, new_y)
+            return t
+        return 0
+    
+    def sweep(self, dt, field, tetris, path=None):
+        """
+        Accelerate the figure and move it as far as it gets in dt
+        
+        Unlike `step`, the figure may move any number of cells, so its speed
+        doesn't depend on the tick length. See the `sweep` function.
+        :param dt: time since the previous step, in seconds
+        :param field: GravityField
+        :param tetris: TetrisSystem
+        :param path: if a list, every position passed is appended to it
+        :return: 0 if the figure hasn't bumped into anything, otherwise the
+        TetrisSystem cell value it has bumped into. In the latter case the
+        figure stays in the last free cell
+        """
+        xpos, ypos = self.pos
+        cell = field[xpos][ypos]
+        self.vx += cell.ax * dt
+        self.vy += cell.ay * dt
+        x_covered = self.x_covered
+        y_covered = self.y_covered
+        self.x_covered = (x_covered + abs(self.vx) * dt) % 1
+        self.y_covered = (y_covered + abs(self.vy) * dt) % 1
+        return sweep(self, self.vx, self.vy, x_covered, y_covered, dt, tetris,
+                     path)
+
+
+class FigureSwarm:
+    """
+    All the flying figures, moved together
+    
+    Positions, velocities and step timers of every figure are kept in
+    parallel arrays, so that a tick is a few array operations no matter how
+    many figures there are. Only the figures that actually try to move to
+    another cell are checked against the TetrisSystem one by one.
+    
+    While a Figure is in the swarm, its velocity and timers live in these
+    arrays; they are written back to the Figure when it's removed. Its `pos`
+    is kept up to date all the time.
+    
+    With swept movement, figures are moved like Figure.sweep does instead.
+    """
+    # Per-figure arrays and their dtypes
+    fields = (('x', int), ('y', int), ('vx', float), ('vy', float),
+              ('x_delay', float), ('y_delay', float),
+              ('x_waited', float), ('y_waited', float),
+              ('x_covered', float), ('y_covered', float))
+    
+    def __init__(self, swept=False):
+        """
+        
+        :param swept: if True, figures move any number of cells per step
+        """
+        self.swept = swept
+        self.figures = []
+        for name, dtype in self.fields:
+            setattr(self, name, np.zeros(0, dtype=dtype))
+    
+    def add(self, figure):
+        """
+        Add a figure, with its current position, velocity and timers
+        :param figure: Figure
+        :return:
+        """
+        self.figures.append(figure)
+        values = figure.pos + tuple(getattr(figure, name)
+                                    for name, dtype in self.fields[2:])
+        for (name, dtype), value in zip(self.fields, values):
+            setattr(self, name, np.append(getattr(self, name), value))
+    
+    def remove(self, figure):
+        """
+        Remove a figure and write its state back to it
+        
+        Removing a figure that isn't in the swarm does nothing.
+        :param figure: Figure
+        :return:
+        """
+        if figure not in self.figures:
+            return
+        self.sync(figure)
+        i = self.figures.index(figure)
+        del self.figures[i]
+        for name, dtype in self.fields:
+            setattr(self, name, np.delete(getattr(self, name), i))
+    
+    def sync(self, figure):
+        """
+        Write the figure's velocity and timers back to it, keeping it in the
+        swarm
+        :param figure: Figure
+        :return:
+        """
+        if figure not in self.figures:
+            return
+        i = self.figures.index(figure)
+        for name, dtype in self.fields[2:]:
+            setattr(figure, name, getattr(self, name)[i].item())
+    
+    def step(self, dt, field, tetris):
+        """
+        Accelerate all figures and move each by at most one cell along each
+        axis
+        
+        Does exactly what Figure.step would do for every figure. All figures
+        are checked against the same board, and those that bump into
+        something stay where they were.
+        :param dt: time since the previous step, in seconds
+        :param field: GravityField
+        :param tetris: TetrisSystem
+        :return: a list of figures that have moved, and a list of (figure,
+        cell value) pairs for those that collided with something
+        """
+        moved = []
+        hits = []
+        if not self.figures:
+            return moved, hits
+        if self.swept:
+            return self.sweep(dt, field, tetris)
+        self.x_waited += dt
+        self.y_waited += dt
+        cell = field.sample(self.x, self.y)
+        self.vx += cell.ax * dt
+        self.vy += cell.ay * dt
+        moving_x = self.vx != 0
+        moving_y = self.vy != 0
+        with np.errstate(divide='ignore'):
+            self.x_delay = np.where(moving_x, np.abs(1 / self.vx),
+                                    self.x_delay)
+            self.y_delay = np.where(moving_y, np.abs(1 / self.vy),
+                                    self.y_delay)
+        step_x = moving_x & (self.x_waited >= self.x_delay)
+        step_y = moving_y & (self.y_waited >= self.y_delay)
+        self.x_waited[step_x] = 0
+        self.y_waited[step_y] = 0
+        new_x = self.x + np.where(step_x, np.sign(self.vx), 0).astype(int)
+        new_y = self.y + np.where(step_y, np.sign(self.vy), 0).astype(int)
+        for i in np.nonzero(step_x | step_y)[0].tolist():
+            figure = self.figures[i]
+            pos = (int(new_x[i]), int(new_y[i]))
+            t = tetris.check_move(pos, figure.chars, figure.mask)
+            if t == 0:
+                self.x[i], self.y[i] = pos
+                figure.pos = pos
+                moved.append(figure)
+            else:
+                hits.append((figure, t))
+        return moved, hits
+    
+    def sweep(self, dt, field, tetris):
+        """
+        Accelerate all figures and move each as far as it gets
+        
+        Does exactly what Figure.sweep would do for every figure. Figures
+        that bump into something are moved to the last free cell before it,
+        so they may be both moved and hit.
+        :param dt: time since the previous step, in seconds
+        :param field: GravityField
+        :param tetris: TetrisSystem
+        :return: same as step
+        """
+        moved = []
+        hits = []
+        cell = field.sample(self.x, self.y)
+        self.vx += cell.ax * dt
+        self.vy += cell.ay * dt
+        x_distance = self.x_covered + np.abs(self.vx) * dt
+        y_distance = self.y_covered + np.abs(self.vy) * dt
+        for i in np.nonzero((x_distance >= 1) | (y_distance >= 1))[0].tolist():
+            figure = self.figures[i]
+            pos = figure.pos
+            t = sweep(figure, self.vx[i].item(), self.vy[i].item(),
+                      self.x_covered[i].item(), self.y_covered[i].item(), dt,
+                      tetris)
+            if figure.pos != pos:
+                self.x[i], self.y[i] = figure.pos
+                moved.append(figure)
+            if t:
+                hits.append((figure, t))
+        self.x_covered = x_distance % 1
+        self.y_covered = y_distance % 1
+        return moved, hits
+    
+    def __len__(self):
+        return len(self.figures)
+
+
+class CellCache(dict):
+    """
+    Field cells as plain floats, looked up once each
+    
+    Supports the same ``field[x][y].ax`` lookups as a GravityField. A
+    prediction visits the same few cells for many ticks, and float arithmetic
+    is much cheaper than that on numpy scalars (the results are the same).
+    """
+    def __init__(self, field):
+        super().__init__()
+        self.field = field
+    
+    def __missing__(self, x):
+        column = self[x] = CachedColumn(self.field, x)
+        return column
+
+
+class CachedColumn(dict):
+    def __init__(self, field, x):
+        super().__init__()
+        self.field = field
+        self.x = x
+    
+    def __missing__(self, y):
+        cell = self.field[self.x][y]
+        r = self[y] = Gravcell(float(cell.ax), float(cell.ay))
+        return r
+
+
+class TrajectoryPredictor:
+    """
+    Predicts where a flying figure is going
+    
+    The figure's path is calculated ahead with the same Figure.step the game
+    uses, until it bumps into something or `max_ticks` pass. The prediction is
+    kept until an attractor moves or another figure is asked about, and is
+    shortened as the figure flies along it.
+    """
+    def __init__(self, field, tetris, dt=TIMESTEP, max_ticks=600,
+                 swept=False):
+        """
+        
+        :param field: GravityField
+        :param tetris: TetrisSystem
+        :param dt: tick length, in seconds
+        :param max_ticks: how far ahead to look
+        :param swept: whether figures use swept movement
+        """
+        self.field = field
+        self.tetris = tetris
+        self.dt = dt
+        self.max_ticks = max_ticks
+        self.swept = swept
+        self.figure = None
+        self.version = None
+        # Positions the figure will move to, in order
+        self.path = []
+        # The value check_move will return at the end of the path, or 0 if
+        # the figure is still flying after max_ticks
+        self.result = 0
+    
+    def predict(self, figure, swarm=None):
+        """
+        Return the path ahead of the figure
+        
+        :param figure: Figure
+        :param swarm: FigureSwarm the figure is in, if any. Its state there
+        is more recent than in the Figure itself
+        :return: list of positions
+        """
+        if figure is not self.figure or self.field.version != self.version:
+            if swarm:
+                swarm.sync(figure)
+            self.figure = figure
+            self.version = self.field.version
+            self.path, self.result = self.calculate(figure)
+        elif figure.pos in self.path:
+            # Drop the part that is already behind
+            del self.path[:self.path.index(figure.pos) + 1]
+        return self.path
+    
+    def calculate(self, figure):
+        ghost = Figure(figure.chars, figure.pos, figure.vx, figure.vy,
+                       mask=figure.mask)
+        ghost.x_delay = figure.x_delay
+        ghost.y_delay = figure.y_delay
+        ghost.x_waited = figure.x_waited
+        ghost.y_waited = figure.y_waited
+        ghost.x_covered = figure.x_covered
+        ghost.y_covered = figure.y_covered
+        # Doesn't update the real field, so that the game doesn't change
+        # whether it's being previewed or not
+        field = CellCache(self.field.peek())
+        path = []
+        if self.swept:
+            # Every cell passed is on the path, not just where ticks end
+            for _ in range(self.max_ticks):
+                t = ghost.sweep(self.dt, field, self.tetris, path)
+                if t:
+                    return path, t
+            return path, 0
+        pos = ghost.pos
+        for _ in range(self.max_ticks):
+            t = ghost.step(self.dt, field, self.tetris)
+            if t:
+                return path, t
+            if ghost.pos != pos:
+                pos = ghost.pos
+                path.append(pos)
+        return path, 0
+
+
+class Emitter:
+    """
+    The thing that travels clockwise around the screen edges and launches
+    figures
+    """
+    def __init__(self, pos, size=(5, 5), board_size=BOARD_SIZE,
+                 speed=EMITTER_SPEED, launch_time=LAUNCH_TIME):
+        """
+        
+        :param pos: position
+        :param size: emitter size
+        :param board_size: board size
+        :param speed: speed along the edges, cells per second, as (x, y)
+        :param launch_time: see LAUNCH_TIME
+        """
+        self.pos = pos
+        self.size = size
+        self.board_size = board_size
+        # Where the figures are launched to
+        self.target = board_layout(board_size).target
+        self.have_waited = 0
+        self.abs_vx, self.abs_vy = speed
+        self.launch_time = launch_time
+        # Initially moves to the left
+        self.vx = -1 * self.abs_vx
+        self.delay = 1/self.abs_vx
+        self.vy = 0
+        # Where it was before the last step
+        self.last_pos = pos
+    
+    def step(self, dt):
+        """
+        Move the emitter if it's time to
+        :param dt: time since the previous step, in seconds
+        :return: True if it has moved
+        """
+        self.have_waited += dt
+        if self.have_waited < self.delay:
+            return False
+        pos = self.pos
+        if self.vx != 0:
+            new_x = pos[0]+round(abs(self.vx)/self.vx)
+        else:
+            new_x = pos[0]
+        if self.vy != 0:
+            new_y = pos[1]+round(abs(self.vy)/self.vy)
+        else:
+            new_y = pos[1]
+        self.last_pos = pos
+        self.pos = (new_x, new_y)
+        # The emitter always moves clockwise
+        # So some stuff is hardcoded
+        if new_x == 0 and self.vx < 0:
+            #Lower left
+            self.vx = 0
+            self.vy = -1 * self.abs_vy
+            self.delay = 1/self.abs_vy
+        elif new_y == 0 and self.vy < 0:
+            # Upper left
+            self.vy = 0
+            self.vx = self.abs_vx
+            self.delay = 1/self.abs_vx
+        elif new_x + self.size[0] == self.board_size[0] and self.vx > 0:
+            #Upper right
+            self.vx = 0
+            self.vy = self.abs_vy
+            self.delay = 1/self.abs_vy
+        elif new_y + self.size[1] == self.board_size[1] and self.vy > 0:
+            # Lower right
+            self.vx = -1 * self.abs_vx
+            self.vy = 0
+            self.delay = 1/self.abs_vx
+        self.have_waited = 0
+        return True
+    
+    def is_lost(self, tetris):
+        """
+        Check whether the building has reached the emitter
+        
+        The check is done for the position before the last step
+        :param tetris: TetrisSystem
+        :return:
+        """
+        x, y = self.last_pos
+        row = ((1 << self.size[0]) - 1) << x
+        for y_offset in range(self.size[1]):
+            if tetris.installed[y + y_offset] & row:
+                return True
+        return False
+    
+    def launch(self, figure):
+        """
+        Put the figure at the emitter and send it towards the board center
+        :param figure: Figure
+        :return:
+        """
+        figure.pos = (self.pos[0]+1, self.pos[1]+1)
+        figure.vx = (self.target[0] - self.pos[0])/self.launch_time
+        figure.vy = (self.target[1] - self.pos[1])/self.launch_time
+
+
+class Simulation:
+    """
+    The whole game without any front end
+    
+    Every step is a single tick, and within it things are updated in the same
+    order the front end's listeners get their events: emitter first, then the
+    flying figure, then installation and removal of the lines and squares.
+    """
+    def __init__(self, size=BOARD_SIZE, seed=None, figures=None,
+                 timestep=TIMESTEP, mass=ATTRACTOR_MASS,
+                 emitter_speed=EMITTER_SPEED, launch_time=LAUNCH_TIME,
+                 swept=SWEPT_MOVEMENT):
+        """
+        
+        :param size: tuple of ints (xsize, ysize)
+        :param seed: seed for the figure RNG
+        :param figures: dict of figure names to chars. Defaults to FIGURES
+        :param timestep: tick length in seconds
+        :param mass: attractor mass
+        :param emitter_speed: emitter speed, see EMITTER_SPEED
+        :param launch_time: see LAUNCH_TIME
+        :param swept: whether figures use swept movement, see SWEPT_MOVEMENT
+        """
+        self.size = size
+        self.swept = swept
+        self.mass = mass
+        self.emitter_speed = emitter_speed
+        self.launch_time = launch_time
+        self.seed = seed
+        self.figures = figures or FIGURES
+        self.figure_names = list(self.figures)
+        if self.figures is FIGURES:
+            self.masks = FIGURE_MASKS
+        else:
+            self.masks = {name: figure_mask(chars)
+                          for name, chars in self.figures.items()}
+        self.timestep = timestep
+        self.reset()
+    
+    def reset(self):
+        """
+        Start a new game
+        :return:
+        """
+        self.rng = random.Random(self.seed)
+        self.field = GravityField(self.size, lazy=True)
+        self.tetris = TetrisSystem(self.size)
+        layout = board_layout(self.size)
+        self.tetris.install(layout.start, START_FIGURE)
+        self.attractors = []
+        for pos in layout.attractors:
+            attractor = Mass(mass=self.mass)
+            self.field.add_attractor(attractor, pos)
+            self.attractors.append(attractor)
+        self.emitter = Emitter(layout.emitter, board_size=self.size,
+                               speed=self.emitter_speed,
+                               launch_time=self.launch_time)
+        self.swarm = FigureSwarm(swept=self.swept)
+        self.next_figure = self.create_figure()
+        # The front end creates one more figure and immediately destroys it to
+        # trigger the first launch. It still uses up a random choice
+        self.create_figure()
+        # The last launched figure
+        self.figure = None
+        self.launch()
+        self.ticks = 0
+        self.time = 0
+        self.score = 0
+        self.installations = 0
+        self.fly_aways = 0
+        self.lost = False
+    
+    def create_figure(self):
+        name = self.rng.choice(self.figure_names)
+        return Figure(self.figures[name], vx=0, vy=0, mask=self.masks[name])
+    
+    def launch(self):
+        """
+        Launch the figure waiting in the emitter and load a new one
+        :return:
+        """
+        self.figure = self.next_figure
+        self.emitter.launch(self.figure)
+        self.swarm.add(self.figure)
+        self.next_figure = self.create_figure()
+    
+    def move_attractor(self, index, pos):
+        self.field.move_attractor(self.attractors[index], pos)
+    
+    def step(self, dt=None):
+        """
+        Run a single tick
+        :param dt: tick length in seconds. Defaults to self.timestep
+        :return: list of Events emitted during this tick
+        """
+        if dt is None:
+            dt = self.timestep
+        self.ticks += 1
+        self.time += dt
+        r = []
+        if self.emitter.step(dt) and self.emitter.is_lost(self.tetris):
+            self.lost = True
+            r.append(Event(event_type='game_lost', event_value=None))
+        moved, hits = self.swarm.step(dt, self.field, self.tetris)
+        for figure, t in hits:
+            self.swarm.remove(figure)
+            if t == 1:
+                r.append(Event(event_type='request_installation',
+                               event_value=figure))
+                self.tetris.install(figure.pos, figure.chars)
+                self.installations += 1
+                removals = self.tetris.check_for_removal(
+                    figure.pos, (len(figure.chars[0]), len(figure.chars)))
+                for event in removals:
+                    self.score += SCORES[event.event_type]
+                r += removals
+            else:
+                r.append(Event(event_type='request_destruction',
+                               event_value=figure))
+                self.fly_aways += 1
+            self.launch()
+        return r
+    
+    def run(self, ticks=None):
+        """
+        Run the game until it's lost or for a given number of ticks
+        :param ticks: max number of ticks. If None, run until the game is lost
+        :return:
+        """
+        n = 0
+        while not self.lost and (ticks is None or n < ticks):
+            self.step()
+            n += 1
+        return self
@@ -1,210 +1,139 @@
 """
-Game classes
+Game widgets and listeners
+
+The rules themselves are in engine.py, these classes only connect them to
+bear_hug.
 """
 
-from bear_hug.bear_utilities import copy_shape
 from bear_hug.event import BearEvent
 from bear_hug.widgets import Widget, Listener, Layout
 
-from collections import namedtuple
-from math import sqrt
+from engine import Figure, FigureSwarm, Emitter, TrajectoryPredictor,\
+    figure_mask, board_layout, CHUNKED_AREA, SWEPT_MOVEMENT
+from storage import PaletteGrid
 import random
-Gravcell = namedtuple('Gravcell', ('ax', 'ay'))
 
 
-class GravityField:
-    """
-    A gravity field that contains multiple attractors
+def redraw_region(widget, x, y, xsize, ysize):
     """
-    def __init__(self, size):
-        """
-        
-        :param size: tuple of ints (xsize, ysize)
-        """
-        self.size = size
-        self.sum_field = [[Gravcell(0, 0) for y in range(size[1])]
-                          for x in range(size[0])]
-        self.attractor_fields = {}
-        self.positions = {}
-        
-    def add_attractor(self, attractor, pos):
-        """
-        Add an attractor
-        :param attractor:
-        :return:
-        """
-        assert isinstance(attractor, Attractor)
-        self.positions[attractor] = pos
-        self.attractor_fields[attractor] = [[Gravcell(0, 0)
-                                             for y in range(self.size[1])]
-                                            for x in range(self.size[0])]
-        self.rebuild_attractor_field(attractor)
-        self.rebuild_sum_field()
-        
-    def move_attractor(self, attractor, pos):
-        self.positions[attractor] = pos
-        self.rebuild_attractor_field(attractor)
-        self.rebuild_sum_field()
+    Redraw only a part of the widget
     
-    def rebuild_attractor_field(self, attractor):
-        """
-        Rebuild the attractor's field
-        :param attractor:
-        :return:
-        """
-        for x in range(self.size[0]):
-            for y in range(self.size[1]):
-                dist = sqrt((x - self.positions[attractor][0] -
-                                 attractor.mass_center[0]) ** 2 +
-                            (y - self.positions[attractor][1] -
-                                 attractor.mass_center[1]) ** 2)
-                if self.positions[attractor][0] + attractor.mass_center[0] != x:
-                    a_x = attractor.mass * abs(x - self.positions[attractor][0]
-                                       - attractor.mass_center[0]) / dist ** 3
-                    if self.positions[attractor][0] + attractor.mass_center[0] < x:
-                        a_x *= -1
-                else:
-                    a_x = 0
-                if self.positions[attractor][1] + attractor.mass_center[1] != y:
-                    a_y = attractor.mass * abs(y - self.positions[attractor][1]
-                                           - attractor.mass_center[1]) / dist ** 3
-                    if self.positions[attractor][1] + attractor.mass_center[1] < y:
-                        a_y *= -1
-                else:
-                    a_y = 0
-                self.attractor_fields[attractor][x][y] = Gravcell(a_x, a_y)
-            
-    def rebuild_sum_field(self):
-        """
-        Rebuild sum field as a sum of attractor fields
-        :return:
-        """
-        for x in range(self.size[0]):
-            for y in range(self.size[1]):
-                a_x = sum(self.attractor_fields[a][x][y].ax
-                            for a in self.attractor_fields)
-                a_y = sum(self.attractor_fields[a][x][y].ay
-                            for a in self.attractor_fields)
-                self.sum_field[x][y] = Gravcell(a_x, a_y)
-    
-    def __getitem__(self, item):
-        # List API for ease of lookup
-        return self.sum_field[item]
+    Falls back to redrawing the whole widget if the terminal can't do that.
+    :param widget: a widget on the terminal
+    :param x: leftmost column
+    :param y: topmost row
+    :param xsize: region width
+    :param ysize: region height
+    :return:
+    """
+    if hasattr(widget.terminal, 'update_region'):
+        widget.terminal.update_region(widget, x, y, xsize, ysize)
+    else:
+        widget.terminal.update_widget(widget)
 
 
-class TetrisSystem:
+class FigurePhysics(Listener):
     """
-    All the tetris logic
+    A listener that moves all the flying figures on every tick
     
-    Cell can contain either zero (can move), 1 (should stop and all the moved
-    cells become 1) or 2 (should stop and moved element should be destroyed,
-    eg with screen edges or attractor centers).
-    2 takes precedence over 1
+    The figures are stepped together in an engine.FigureSwarm, so having many
+    of them in flight costs about as much as having one.
     """
-    def __init__(self, size):
-        self.size = size
-        self.cells = [[0 for y in range(size[1])] for x in range(size[0])]
-        for x in range(size[0]):
-            self.cells[x][0] = 2
-            self.cells[x][size[1]-1] = 2
-        for y in range(2, size[1]-1):
-            self.cells[0][y] = 2
-            self.cells[size[0]-1][y] = 2
-            
-    def check_move(self, pos, chars):
-        for x_offset in range(len(chars[0])):
-            for y_offset in range(len(chars)):
-                c = self.cells[pos[0]+x_offset][pos[1] + y_offset]
-                if c > 0 and chars[y_offset][x_offset] != ' ':
-                    return c
-        return 0
+    def __init__(self, field, tetris, swept=SWEPT_MOVEMENT):
+        self.field = field
+        self.tetris = tetris
+        self.swarm = FigureSwarm(swept=swept)
+        # Figure bodies to their widgets
+        self.widgets = {}
     
-    def check_for_removal(self):
-        """
-        Check if something is to be removed
-        :param pos:
-        :return:
-        """
-        # Return events, so this is expected to be called by FigureManager's
-        # on_event. Later BuildingWidget will catch the event and update itself
-        # accordingly. Maybe also some sound emission or animation or something
-        r = []
-        for x in range(len(self.cells)-3):
-            for y in range(len(self.cells[0])-3):
-                # Check whether a given cell is a top-left corner of something
-                if self[x][y] == 1:
-                    if x <= len(self.cells) - 7:
-                        #Check whether this cell is left side of horizontal 7
-                        h7 = True
-                        for x_1 in range(1, 7):
-                            if self[x + x_1][y] != 1:
-                                h7 = False
-                        if h7:
-                            for x_1 in range(7):
-                                self[x+x_1][y] = 0
-                            r += [BearEvent(event_type='h7',
-                                           event_value=(x, y)),
-                                  BearEvent(event_type='play_sound',
-                                            event_value='explosion')]
-                    if y <= len(self.cells[0]) - 7:
-                        # Or a vertical 7
-                        v7 = True
-                        for y_1 in range(1, 7):
-                            if self[x][y+y_1] != 1:
-                                v7 = False
-                        if v7:
-                            for y_1 in range(1, 7):
-                                self[x][y+y_1] = 0
-                            r += [(BearEvent(event_type='v7',
-                                               event_value=(x, y))),
-                                  BearEvent(event_type='play_sound',
-                                            event_value='explosion')]
-                    if x <= len(self.cells)-3 and y <= len(self.cells[0])-3:
-                        sq = True
-                        for x_1 in range(3):
-                            for y_1 in range(3):
-                                if self[x+x_1][y+y_1] != 1:
-                                    sq = False
-                        if sq:
-                            for x_1 in range(3):
-                                for y_1 in range(3):
-                                    self[x+x_1][y+y_1] = 0
-                            r += [BearEvent(event_type='square',
-                                               event_value=(x, y)),
-                                 BearEvent(event_type='play_sound',
-                                           event_value='explosion')]
-        return r
+    def add_figure(self, widget):
+        self.swarm.add(widget.body)
+        self.widgets[widget.body] = widget
     
-    def __getitem__(self, item):
-        return self.cells[item]
-        
-        
+    def remove_figure(self, widget):
+        self.swarm.remove(widget.body)
+        self.widgets.pop(widget.body, None)
+    
+    def on_event(self, event):
+        if event.event_type == 'tick':
+            moved, hits = self.swarm.step(event.event_value, self.field,
+                                          self.tetris)
+            for body in moved:
+                widget = self.widgets[body]
+                widget.parent.move_widget(widget, body.pos)
+            r = []
+            for body, t in hits:
+                if t == 1:
+                    r += [BearEvent(event_type='request_installation',
+                                    event_value=self.widgets[body]),
+                          BearEvent(event_type='play_sound',
+                                    event_value='connect')]
+                elif t == 2:
+                    r += [BearEvent(event_type='request_destruction',
+                                    event_value=self.widgets[body]),
+                          BearEvent(event_type='play_sound',
+                                    event_value='fly_away')]
+            return r
+
+
 class FigureManager(Listener):
-    def __init__(self, field, tetris, dispatcher, building, atlas):
+    def __init__(self, field, tetris, dispatcher, building, atlas,
+                 physics=None):
         self.field = field
         self.tetris = tetris
+        self.physics = physics
         self.dispatcher = dispatcher
         self.building = building
         self.atlas = atlas
         self.figure_names = [x for x in self.atlas.elements if 'f_' in x]
+        # Chars, colors and row mask of every figure, read from the atlas
+        # only once. Widgets of the same figure share these lists
+        self.templates = {}
+        for name in self.figure_names:
+            chars, colors = self.atlas.get_element(name)
+            self.templates[name] = (chars, colors, figure_mask(chars))
+        # Destroyed figure widgets, waiting to be reused by create_figure
+        self.pool = {name: [] for name in self.figure_names}
     
     def on_event(self, event):
         if event.event_type == 'request_destruction':
             self.destroy_figure(event.event_value)
         elif event.event_type == 'request_installation':
             self.stop_figure(event.event_value)
-            return self.tetris.check_for_removal()
+            r = []
+            for removal in self.tetris.check_for_removal(
+                    event.event_value.body.pos, event.event_value.size):
+                r += [BearEvent(event_type=removal.event_type,
+                                event_value=removal.event_value),
+                      BearEvent(event_type='play_sound',
+                                event_value='explosion')]
+            return r
             
     def create_figure(self):
-        return Attractee(*self.atlas.get_element(
-                random.choice(self.figure_names)),
-                               field=self.field, vx=0, vy=0,
-                               tetris=self.tetris)
+        name = random.choice(self.figure_names)
+        if self.pool[name]:
+            widget = self.pool[name].pop()
+            widget.reset(vx=0, vy=0)
+            return widget
+        chars, colors, mask = self.templates[name]
+        return Attractee(chars, colors, field=self.field, vx=0, vy=0,
+                         tetris=self.tetris, mask=mask, name=name)
     
     def destroy_figure(self, widget):
+        if self.physics:
+            self.physics.remove_figure(widget)
         self.terminal.remove_widget(widget)
         self.dispatcher.unregister_listener(widget, 'all')
-        self.create_figure()
+        self.recycle(widget)
+    
+    def recycle(self, widget):
+        """
+        Keep a figure widget that's no longer used for create_figure
+        :param widget:
+        :return:
+        """
+        if widget.name in self.pool:
+            self.pool[widget.name].append(widget)
         
     def stop_figure(self, widget):
         """
@@ -213,12 +142,8 @@ class FigureManager(Listener):
         :param widget:
         :return:
         """
-        pos = self.terminal.widget_locations[widget].pos
-        self.building.add_figure(widget, pos)
-        for x_offset in range(widget.width):
-            for y_offset in range(widget.height):
-                if widget.chars[y_offset][x_offset] != ' ':
-                    self.tetris[pos[0]+x_offset][pos[1]+y_offset] = 1
+        self.building.add_figure(widget, widget.body.pos)
+        self.tetris.install(widget.body.pos, widget.chars)
         self.destroy_figure(widget)
 
 
@@ -226,12 +151,24 @@ class BuildingWidget(Widget):
     """
     A widget that displays all the already installed blocks
     
-    It only *displays* them, ie any logic is in TetrisSystem or widgets' code
+    It only *displays* them, ie any logic is in TetrisSystem or widgets' code.
+    Chars and colors are stored as PaletteGrids, ie a byte per cell each, or
+    less if chunked.
     """
-    def __init__(self, size):
-        chars = [[' ' for x in range(size[0])] for y in range(size[1])]
-        colors = copy_shape(chars, 'dark gray')
-        super().__init__(chars, colors)
+    def __init__(self, size, chunked=None):
+        """
+        
+        :param size: tuple of ints (xsize, ysize)
+        :param chunked: if True, use chunked grids that only allocate the
+        chunks with something in them. By default, boards larger than
+        CHUNKED_AREA cells are chunked
+        """
+        if chunked is None:
+            chunked = size[0] * size[1] > CHUNKED_AREA
+        # Widget only accepts lists, so it gets a placeholder
+        super().__init__([[' ']], [['dark gray']])
+        self.chars = PaletteGrid.filled(size, ' ', chunked=chunked)
+        self.colors = PaletteGrid.filled(size, 'dark gray', chunked=chunked)
     
     def add_figure(self, figure, pos):
         for y_offset in range(figure.height):
@@ -242,7 +179,10 @@ class BuildingWidget(Widget):
                     self.colors[pos[1]+y_offset][pos[0]+x_offset] = \
                         figure.colors[y_offset][x_offset]
         if self.terminal:
-            self.terminal.update_widget(self)
+            self.update_region(pos[0], pos[1], figure.width, figure.height)
+    
+    def update_region(self, x, y, xsize, ysize):
+        redraw_region(self, x, y, xsize, ysize)
     
     def on_event(self, event):
         if event.event_type == 'square':
@@ -250,19 +190,69 @@ class BuildingWidget(Widget):
             for x_off in range(3):
                 for y_off in range(3):
                     self.chars[y+y_off][x+x_off] = ' '
-            self.terminal.update_widget(self)
+            self.update_region(x, y, 3, 3)
         elif event.event_type == 'v7':
             x, y = event.event_value
             for y_off in range(7):
                 self.chars[y+y_off][x] = ' '
-            self.terminal.update_widget(self)
+            self.update_region(x, y, 1, 7)
         elif event.event_type == 'h7':
             x, y = event.event_value
             for x_off in range(7):
                 self.chars[y][x+x_off] = ' '
-            self.terminal.update_widget(self)
+            self.update_region(x, y, 7, 1)
 
     
+class TrajectoryOverlay(Widget):
+    """
+    A widget that shows where the last launched figure is going
+    
+    The figure's center is marked with dots along the path predicted by
+    engine.TrajectoryPredictor. The path is only recalculated when an
+    attractor moves or a new figure is launched; otherwise the part already
+    flown is cut off. Only the dots that have changed are redrawn.
+    """
+    def __init__(self, size, field, tetris, physics, chunked=None):
+        """
+        
+        :param size: board size
+        :param field: GravityField
+        :param tetris: TetrisSystem
+        :param physics: FigurePhysics that moves the figures
+        :param chunked: see BuildingWidget
+        """
+        if chunked is None:
+            chunked = size[0] * size[1] > CHUNKED_AREA
+        super().__init__([[' ']], [['gray']])
+        self.chars = PaletteGrid.filled(size, ' ', chunked=chunked)
+        self.colors = PaletteGrid.filled(size, 'gray', chunked=chunked)
+        self.predictor = TrajectoryPredictor(field, tetris,
+                                             swept=physics.swarm.swept)
+        self.physics = physics
+        # Cells that currently have a dot
+        self.cells = set()
+    
+    def on_event(self, event):
+        if event.event_type == 'service' and \
+                event.event_value == 'tick_over':
+            cells = set()
+            if self.physics.swarm.figures:
+                figure = self.physics.swarm.figures[-1]
+                dx = len(figure.chars[0]) // 2
+                dy = len(figure.chars) // 2
+                for x, y in self.predictor.predict(figure,
+                                                   self.physics.swarm):
+                    cells.add((x + dx, y + dy))
+            if cells != self.cells and self.terminal:
+                for x, y in self.cells - cells:
+                    self.chars[y][x] = ' '
+                    redraw_region(self, x, y, 1, 1)
+                for x, y in cells - self.cells:
+                    self.chars[y][x] = '·'
+                    redraw_region(self, x, y, 1, 1)
+                self.cells = cells
+
+
 class Attractor(Widget):
     def __init__(self, *args, mass=100, field=None, mass_center=(2, 2),
                  **kwargs):
@@ -276,95 +266,55 @@ class Attractor(Widget):
         # every TK_MOUSE_MOVE
         self.grab_pos = (0, 0)
         
-    def on_event(self, event):
-        if event.event_type == 'key_down':
-            if event.event_value == 'TK_MOUSE_LEFT':
-                # Mouse left down, check if need to drag
-                mouse_x = self.terminal.check_state('TK_MOUSE_X')
-                mouse_y = self.terminal.check_state('TK_MOUSE_Y')
-                pos = self.terminal.widget_locations[self].pos
-                if pos[0] <= mouse_x <= pos[0] + self.width and \
-                        pos[1] <= mouse_y <= pos[1] + self.height:
-                    self.dragged = True
-                    self.grab_pos = (mouse_x, mouse_y)
-        elif event.event_type == 'key_up':
-            if event.event_value == 'TK_MOUSE_LEFT':
-                if self.dragged:
-                    self.dragged = False
-        elif event.event_type == 'misc_input':
-            if event.event_value == 'TK_MOUSE_MOVE' and self.dragged:
-                mouse_x = self.terminal.check_state('TK_MOUSE_X')
-                mouse_y = self.terminal.check_state('TK_MOUSE_Y')
-                if mouse_x != self.grab_pos[0] or \
-                        mouse_y != self.grab_pos[1]:
-                    pos = self.terminal.widget_locations[self].pos
-                    shift = (mouse_x-self.grab_pos[0], mouse_y - self.grab_pos[1])
-                    if -1 < pos[0] + shift[0] < 56 and\
-                            -1 < pos[1] + shift[1] < 41:
-                        self.terminal.move_widget(self,
-                                    (pos[0]+shift[0], pos[1]+shift[1]))
-                        self.grab_pos = (self.grab_pos[0]+shift[0],
-                                         self.grab_pos[1]+shift[1])
-                        self.terminal.refresh()
-                        self.field.move_attractor(self,
-                                              (pos[0]+shift[0], pos[1]+shift[1]))
+    # Mouse input comes from mouse.InputRouter
+    
+    def press(self, mouse_x, mouse_y):
+        self.dragged = True
+        self.grab_pos = (mouse_x, mouse_y)
+        return True
+    
+    def release(self, mouse_x, mouse_y):
+        self.dragged = False
+    
+    def drag(self, mouse_x, mouse_y):
+        if mouse_x != self.grab_pos[0] or \
+                mouse_y != self.grab_pos[1]:
+            pos = self.terminal.widget_locations[self].pos
+            shift = (mouse_x-self.grab_pos[0], mouse_y - self.grab_pos[1])
+            # Attractor should stay within the board
+            if -1 < pos[0] + shift[0] <= \
+                    self.field.size[0] - self.width and \
+                    -1 < pos[1] + shift[1] <= \
+                    self.field.size[1] - self.height:
+                self.terminal.move_widget(self,
+                            (pos[0]+shift[0], pos[1]+shift[1]))
+                self.grab_pos = (self.grab_pos[0]+shift[0],
+                                 self.grab_pos[1]+shift[1])
+                # Refresh is left to the Refresher, and the field is
+                # lazy, so this is cheap however fast the mouse moves
+                self.field.move_attractor(self,
+                                      (pos[0]+shift[0], pos[1]+shift[1]))
                     
                     
 class Attractee(Widget):
-    def __init__(self, *args, field=None, vx=1, vy=1, tetris=None, **kwargs):
+    """
+    A flying figure widget
+    
+    All the physics is in its engine.Figure body, which is moved by
+    FigurePhysics. The widget only follows it around the screen. Destroyed
+    figures are kept by FigureManager and `reset` before the next use.
+    """
+    def __init__(self, *args, field=None, vx=1, vy=1, tetris=None, mask=None,
+                 name=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.field = field
         self.tetris = tetris
-        self.vx = vx
-        self.vy = vy
-        # Delay between steps, in seconds
-        if self.vx != 0:
-            self.x_delay = abs(1/self.vx)
-        else:
-            self.x_delay = 0
-        if self.vy != 0:
-            self.y_delay = abs(1/self.vy)
-        else:
-            self.y_delay = 0
-        # How long since last step
-        self.x_waited = 0
-        self.y_waited = 0
-        
-    def on_event(self, event):
-        if event.event_type == 'tick':
-            self.x_waited += event.event_value
-            self.y_waited += event.event_value
-            xpos, ypos = self.parent.widget_locations[self].pos
-            self.vx += self.field[xpos][ypos].ax * event.event_value
-            self.vy += self.field[xpos][ypos].ay * event.event_value
-            if self.vx != 0:
-                self.x_delay = abs(1 / self.vx)
-            if self.vy != 0:
-                self.y_delay = abs(1 / self.vy)
-            if self.x_waited >= self.x_delay and self.vx != 0:
-                new_x = xpos + round(self.vx/abs(self.vx))
-                self.x_waited = 0
-            else:
-                new_x = xpos
-            if self.y_waited >= self.y_delay and self.vy != 0:
-                new_y = ypos + round(self.vy/abs(self.vy))
-                self.y_waited = 0
-            else:
-                new_y = ypos
-            if new_x != xpos or new_y != ypos:
-                t = self.tetris.check_move((new_x, new_y), self.chars)
-                if t == 0:
-                    self.parent.move_widget(self, (new_x, new_y))
-                elif t == 1:
-                    return [BearEvent(event_type='request_installation',
-                                      event_value=self),
-                            BearEvent(event_type='play_sound',
-                                      event_value='connect')]
-                elif t == 2:
-                    return [BearEvent(event_type='request_destruction',
-                                     event_value=self),
-                            BearEvent(event_type='play_sound',
-                                      event_value='fly_away')]
+        # Atlas element name, if any
+        self.name = name
+        self.body = Figure(self.chars, vx=vx, vy=vy, mask=mask)
+    
+    def reset(self, vx=1, vy=1):
+        self.body.reset(vx=vx, vy=vy)
 
 
 class EmitterWidget(Layout):
@@ -372,76 +322,62 @@ class EmitterWidget(Layout):
     A thing that emits widgets when either request_destruction or
     request_installation happens
     
-    Else it just travels around screen edges.
+    Else it just travels around screen edges. The movement itself is done by
+    its engine.Emitter body.
     """
-    def __init__(self, chars, colors, manager, dispatcher, tetris):
+    def __init__(self, chars, colors, manager, dispatcher, tetris, pos=None):
         super().__init__(chars, colors)
         self.manager = manager
         self.dispatcher = dispatcher
         self.tetris = tetris
-        self.have_waited = 0
-        self.abs_vx = 25
-        self.abs_vy = 25
-        # Initially moves to the left
-        self.vx = -1 * self.abs_vx
-        self.delay = 1/self.abs_vx
-        self.vy = 0
+        if pos is None:
+            pos = board_layout(tetris.size).emitter
+        self.body = Emitter(pos, size=self.size, board_size=tetris.size)
         self.add_child(self.manager.create_figure(), pos=(1, 1))
         self.fig = None
+        # Layout redraws itself every tick, but the only thing that changes
+        # inside is the figure waiting to be launched
+        self.need_redraw = True
+    
+    def reset(self, pos=None):
+        """
+        Put the emitter back to the start with a new figure, like a new one
+        would be
+        :param pos: position. Defaults to the board layout's
+        :return:
+        """
+        if pos is None:
+            pos = board_layout(self.tetris.size).emitter
+        self.body = Emitter(pos, size=self.size, board_size=self.tetris.size)
+        old = self.children[1]
+        self.remove_child(old, remove_completely=True)
+        self.manager.recycle(old)
+        self.add_child(self.manager.create_figure(), pos=(1, 1))
+        self.fig = None
+        self.need_redraw = True
+        if self.terminal:
+            self.terminal.move_widget(self, pos)
         
     def on_event(self, event):
-        super().on_event(event)
-        if event.event_type == 'tick':
-            self.have_waited += event.event_value
-            if self.have_waited >= self.delay:
-                pos = self.terminal.widget_locations[self].pos
-                if self.vx != 0:
-                    new_x = pos[0]+round(abs(self.vx)/self.vx)
-                else:
-                    new_x = pos[0]
-                if self.vy != 0:
-                    new_y = pos[1]+round(abs(self.vy)/self.vy)
-                else:
-                    new_y = pos[1]
-                self.terminal.move_widget(self, (new_x, new_y))
-                # The emitter always moves clockwise
-                # So some stuff is hardcoded
-                if new_x == 0 and self.vx < 0:
-                    #Lower left
-                    self.vx = 0
-                    self.vy = -1 * self.abs_vy
-                    self.delay = 1/self.abs_vy
-                elif new_y == 0 and self.vy < 0:
-                    # Upper left
-                    self.vy = 0
-                    self.vx = self.abs_vx
-                    self.delay = 1/self.abs_vx
-                elif new_x + self.width == 60 and self.vx > 0:
-                    #Upper right
-                    self.vx = 0
-                    self.vy = self.abs_vy
-                    self.delay = 1/self.abs_vy
-                elif new_y + self.height == 45 and self.vy > 0:
-                    # Lower right
-                    self.vx = -1 * self.abs_vx
-                    self.vy = 0
-                    self.delay = 1/self.abs_vx
-                self.have_waited = 0
-                for x_offset in range(5):
-                    for y_offset in range(5):
-                        if self.tetris[pos[0]+x_offset][pos[1]+y_offset] == 1:
-                            return [BearEvent(event_type='game_lost',
-                                              event_value=None),
-                                    BearEvent(event_type='play_sound',
-                                              event_value='fail')]
+        if event.event_type == 'service' and \
+                event.event_value == 'tick_over':
+            if self.need_redraw:
+                super().on_event(event)
+                self.need_redraw = False
+        elif event.event_type == 'tick':
+            if self.body.step(event.event_value):
+                self.terminal.move_widget(self, self.body.pos)
+                if self.body.is_lost(self.tetris):
+                    return [BearEvent(event_type='game_lost',
+                                      event_value=None),
+                            BearEvent(event_type='play_sound',
+                                      event_value='fail')]
         elif event.event_type == 'request_installation' or \
                 event.event_type == 'request_destruction':
-            pos = self.terminal.widget_locations[self].pos
             self.fig = self.children[1]
-            # The number 7 is empirical; maybe I'll change it later
-            self.fig.vx = (30 - pos[0])/7
-            self.fig.vy = (23-pos[1])/7
+            self.body.launch(self.fig.body)
             self.remove_child(self.fig, remove_completely=True)
-            self.dispatcher.register_listener(self.fig, 'tick')
-            self.terminal.add_widget(self.fig, (pos[0]+1, pos[1]+1), layer=6)
+            self.manager.physics.add_figure(self.fig)
+            self.terminal.add_widget(self.fig, self.fig.body.pos, layer=6)
             self.add_child(self.manager.create_figure(), (1, 1))
+            self.need_redraw = True
@@ -1,22 +1,39 @@
 #! /usr/bin/env python3.6
 
+import atexit
+import os
+import random
+import struct
 import sys
+import zlib
 
-from bear_hug.bear_hug import BearTerminal, BearLoop
 from bear_hug.event import BearEventDispatcher, BearEvent
-from bear_hug.resources import XpLoader, Atlas
 from bear_hug.widgets import Widget, ClosingListener, Label, Listener
 from bear_hug.sound import SoundListener
 
-from gravity import GravityField, Attractor, TetrisSystem, \
-    FigureManager, BuildingWidget, EmitterWidget
+from engine import GravityField, AsyncGravityField, TetrisSystem,\
+    BOARD_SIZE, ATTRACTOR_MASS, ASYNC_FIELD_AREA, START_FIGURE, TIMESTEP,\
+    board_layout
+from bundle import load_atlas
+from loop import FixedStepLoop
+from mouse import InputRouter
+from profiling import Profiler
+from replay import Recorder
+import snapshot
+from render import DirtyTerminal
+from gravity import Attractor, FigureManager, FigurePhysics, BuildingWidget,\
+    EmitterWidget, TrajectoryOverlay
 from embellish import ScoreCounter
 
+# The bottom bar, with the score and the restart button on it, is this wide
+MIN_BOARD_WIDTH = 60
+
 
 class Refresher(Listener):
     """
     A simple listener that refreshes terminal every tick to prevent other
-    widgets from doing so several times a tick
+    widgets from doing so several times a tick. DirtyTerminal skips the
+    refresh if nothing was drawn
     """
     def __init__(self, t):
         self.terminal = t
@@ -26,6 +43,60 @@ class Refresher(Listener):
             self.terminal.refresh()
 
 
+class ProfileDumper(Listener):
+    """
+    A listener that writes profiling results when F12 is pressed
+    """
+    def __init__(self, profiler, path):
+        self.profiler = profiler
+        self.path = path
+    
+    def on_event(self, event):
+        if event.event_type == 'key_up' and event.event_value == 'TK_F12':
+            self.profiler.dump(self.path)
+
+
+class SaveListener(Listener):
+    """
+    A listener that saves the game when F5 is pressed and loads it on F9
+    
+    Flying figures are not saved, so a loaded game starts with a new launch.
+    """
+    def __init__(self, path):
+        self.path = path
+    
+    def on_event(self, event):
+        if event.event_type != 'key_up':
+            return
+        if event.event_value == 'TK_F5':
+            try:
+                snapshot.save(self.path, take_snapshot())
+            except OSError as e:
+                # Not being able to save is no reason to lose the game
+                print('Cannot save {}: {}'.format(self.path, e),
+                      file=sys.stderr)
+        elif event.event_value == 'TK_F9' and os.path.exists(self.path) \
+                and not recorder:
+            # A loaded game couldn't be replayed from its seed, so there's
+            # no loading while recording
+            try:
+                state = snapshot.load(self.path)
+                # Checked here, because restart_game has already cleared the
+                # board by the time the snapshot checks it
+                if state.size != tuple(tetris.size):
+                    raise ValueError('Save is of a {}x{} board'.format(
+                        *state.size))
+                if len(state.attractors) != 2:
+                    raise ValueError('Save has {} attractors'.format(
+                        len(state.attractors)))
+            except (OSError, ValueError, struct.error, zlib.error) as e:
+                # A broken or foreign save is ignored and the game goes on
+                print('Cannot load {}: {}'.format(self.path, e),
+                      file=sys.stderr)
+                return
+            restart_game(state)
+
+
 class LosingListener(Listener):
     """
     A listener that, when game is lost, announces so.
@@ -49,17 +120,13 @@ class LosingListener(Listener):
 class RestartButton(Label):
     """
     A Label that restarts the game if clicked
+    
+    Clicks come from mouse.InputRouter.
     """
-    def on_event(self, event):
-        if event.event_type == 'key_down' and\
-                event.event_value == 'TK_MOUSE_LEFT':
-            mouse_x = self.terminal.check_state('TK_MOUSE_X')
-            mouse_y = self.terminal.check_state('TK_MOUSE_Y')
-            pos = self.terminal.widget_locations[self].pos
-            if pos[0] <= mouse_x <= pos[0] + self.width and \
-                    pos[1] <= mouse_y <= pos[1] + self.height:
-                close_game()
-                init_game()
+    def press(self, mouse_x, mouse_y):
+        restart_game()
+        # Nothing to drag
+        return False
 
 
 def init_game():
@@ -72,22 +139,37 @@ def init_game():
     global building
     global tetris
     global figures
+    global physics
     global t
     global attractor
     global attractor2
     global emitter
     global initial_figure
+    global trajectory
     global score
     global loop
     global dispatcher
-    field = GravityField((60, 45))
-    building = BuildingWidget((60, 45))
-    tetris = TetrisSystem((60, 45))
+    if recorder:
+        # Every game gets its own seed, so that it can be replayed
+        seed = random.getrandbits(63)
+        random.seed(seed)
+    layout = board_layout(board_size)
+    if board_size[0] * board_size[1] > ASYNC_FIELD_AREA and not recorder:
+        # Big boards are rebuilt in the background, so that dragging an
+        # attractor doesn't stall the game. Not when recording, as a replay
+        # needs the field to change on exactly the same ticks
+        field = AsyncGravityField(board_size)
+    else:
+        field = GravityField(board_size, lazy=True)
+    building = BuildingWidget(board_size)
+    tetris = TetrisSystem(board_size)
+    physics = FigurePhysics(field=field, tetris=tetris)
     figures = FigureManager(field=field,
                             tetris=tetris,
                             dispatcher=dispatcher,
                             building=building,
-                            atlas=atlas)
+                            atlas=atlas,
+                            physics=physics)
     figures.register_terminal(t)
     dispatcher.register_listener(figures, ['request_destruction',
                                            'request_installation'])
@@ -99,128 +181,241 @@ def init_game():
     dispatcher.register_listener(sound, 'play_sound')
     # The construction's start
     building.add_figure(
-        Widget([[' ', '*', ' '], ['*', '*', '*'], [' ', '*', ' ']],
-               [['blue', 'blue', 'blue'], ['blue', 'blue', 'blue'],
-                ['blue', 'blue', 'blue']]), pos=(29, 20))
-    tetris[30][20] = 1
-    tetris[29][21] = 1
-    tetris[30][21] = 1
-    tetris[31][21] = 1
-    tetris[30][22] = 1
+        Widget([list(line) for line in START_FIGURE],
+               [['blue' for char in line] for line in START_FIGURE]),
+        pos=layout.start)
+    tetris.install(layout.start, START_FIGURE)
 
     # Emitter and attractors
     attractor = Attractor(*atlas.get_element('attractor'),
-                          field=field, mass=150)
-    field.add_attractor(attractor, (10, 25))
+                          field=field, mass=ATTRACTOR_MASS)
+    field.add_attractor(attractor, layout.attractors[0])
     attractor2 = Attractor(*atlas.get_element('attractor'),
-                           field=field, mass=150)
-    field.add_attractor(attractor2, (50, 25))
-    dispatcher.register_listener(attractor,
-                                 ['misc_input', 'key_up', 'key_down'])
-    dispatcher.register_listener(attractor2,
-                                 ['misc_input', 'key_up', 'key_down'])
+                           field=field, mass=ATTRACTOR_MASS)
+    field.add_attractor(attractor2, layout.attractors[1])
+    if recorder:
+        # Ticks are recorded before anyone else gets them
+        dispatcher.register_listener(recorder, 'tick')
     emitter = EmitterWidget(*atlas.get_element('emitter'), manager=figures,
-                            dispatcher=dispatcher, tetris=tetris)
+                            dispatcher=dispatcher, tetris=tetris,
+                            pos=layout.emitter)
     dispatcher.register_listener(emitter, ['tick', 'service',
                                            'request_installation',
                                            'request_destruction'])
+    # Figures are moved after the emitter, like they were when each of them
+    # listened to ticks on its own
+    dispatcher.register_listener(physics, 'tick')
     initial_figure = figures.create_figure()
-    dispatcher.register_listener(initial_figure, 'tick')
+    trajectory = TrajectoryOverlay(board_size, field, tetris, physics)
+    dispatcher.register_listener(trajectory, 'service')
     score = ScoreCounter()
     dispatcher.register_listener(score, ['h7', 'v7', 'square'])
     # Adding stuff
-    t.add_widget(score, pos=(39, 47), layer=1)
+    t.add_widget(score, pos=(39, board_size[1] + 2), layer=1)
     t.add_widget(building, pos=(0, 0), layer=0)
-    t.add_widget(attractor, pos=(10, 25), layer=1)
-    t.add_widget(attractor2, pos=(50, 25), layer=3)
-    t.add_widget(emitter, pos=(40, 40), layer=4)
-    t.add_widget(initial_figure, pos=(25, 40), layer=6)
+    t.add_widget(trajectory, pos=(0, 0), layer=2)
+    t.add_widget(attractor, pos=layout.attractors[0], layer=1)
+    t.add_widget(attractor2, pos=layout.attractors[1], layer=3)
+    router.add(attractor)
+    router.add(attractor2)
+    t.add_widget(emitter, pos=layout.emitter, layer=4)
+    t.add_widget(initial_figure, pos=layout.start, layer=6)
     dispatcher.add_event(BearEvent(event_type='request_destruction',
                                    event_value=initial_figure))
+    if recorder:
+        recorder.start_game(seed, field, (attractor, attractor2), tetris,
+                            score)
     
 
-def close_game():
-    global building
-    global attractor
-    global attractor2
-    global emitter
-    global score
-    global dispatcher
-    global t
-    global figures
+def restart_game(state=None):
+    """
+    Start a new game, reusing everything the previous one had
+    
+    Instead of setting everything up again, flying figures are put away, the
+    board, building, attractors and score are copied from a snapshot and the
+    emitter starts over. With the initial snapshot, this is the same game
+    init_game would set up.
+    :param state: snapshot.Snapshot to start from. Defaults to the initial
+    one. If it has an RNG state, that is restored as well
+    :return:
+    """
     global initial_figure
-    figures = None
-    initial_figure = None
-    dispatcher.unregister_listener(building, 'all')
-    dispatcher.unregister_listener(attractor, 'all')
-    dispatcher.unregister_listener(attractor2, 'all')
-    dispatcher.unregister_listener(emitter.fig, 'all')
-    dispatcher.unregister_listener(emitter, 'all')
-    dispatcher.unregister_listener(score, 'all')
-    t.remove_widget(building)
-    t.remove_widget(attractor2)
-    t.remove_widget(attractor)
-    t.remove_widget(emitter.fig)
-    t.remove_widget(emitter)
-    t.remove_widget(score)
-    dispatcher = BearEventDispatcher()
-    dispatcher.register_event_type('request_destruction')
-    dispatcher.register_event_type('request_installation')
-    dispatcher.register_event_type('h7')
-    dispatcher.register_event_type('v7')
-    dispatcher.register_event_type('square')
-    dispatcher.register_event_type('game_lost')
-    #  This is a patent black magic, but it solves some very
-    # weird bug with restarting
-    loop.queue = dispatcher
-    dispatcher.register_listener(loop, 'service')
-    dispatcher.register_listener(r, 'service')
-    dispatcher.register_listener(score, ['h7', 'v7', 'square'])
-    dispatcher.register_listener(restart, 'key_down')
-    dispatcher.register_listener(losing, 'game_lost')
-    dispatcher.register_listener(ClosingListener(), ['misc_input', 'tick'])
+    if state is None:
+        state = initial_snapshot
+    if recorder:
+        # Before the board it checks is reset
+        recorder.end_game()
+        seed = random.getrandbits(63)
+        random.seed(seed)
+    # Whatever the previous game still had queued is of no use now
+    dispatcher.deque.clear()
+    for widget in list(physics.widgets.values()):
+        figures.destroy_figure(widget)
+    if initial_figure in t.widget_locations:
+        # Restarted again before the first launch
+        figures.destroy_figure(initial_figure)
     losing.clean()
+    # Only the cells installed before or after the restore can look any
+    # different, so only their bounding box is redrawn
+    rows = [old | new for old, new in zip(tetris.installed, state.installed)]
+    state.restore(field, (attractor, attractor2), tetris, building=building,
+                  rng=random)
+    ys = [y for y, row in enumerate(rows) if row]
+    if ys:
+        xs = 0
+        for row in rows:
+            xs |= row
+        x = (xs & -xs).bit_length() - 1
+        building.update_region(x, ys[0], xs.bit_length() - x,
+                               ys[-1] - ys[0] + 1)
+    router.release()
+    for widget in (attractor, attractor2):
+        widget.dragged = False
+        t.move_widget(widget, field.positions[widget])
+        router.update(widget)
+    score.set_score(state.score)
+    emitter.reset()
+    initial_figure = figures.create_figure()
+    t.add_widget(initial_figure, pos=board_layout(board_size).start, layer=6)
+    dispatcher.add_event(BearEvent(event_type='request_destruction',
+                                   event_value=initial_figure))
+    if recorder:
+        recorder.start_game(seed, field, (attractor, attractor2), tetris,
+                            score)
 
 
-# Standart BLT boilerplate
-t = BearTerminal(font_path='cp437_12x12.png', size='60x50', title='Indirectris',
-                 filter=['keyboard', 'mouse'])
-dispatcher = BearEventDispatcher()
-dispatcher.register_event_type('request_destruction')
-dispatcher.register_event_type('request_installation')
-dispatcher.register_event_type('h7')
-dispatcher.register_event_type('v7')
-dispatcher.register_event_type('square')
-dispatcher.register_event_type('game_lost')
-loop = BearLoop(t, dispatcher)
-closing = ClosingListener()
-dispatcher.register_listener(closing, ['misc_input', 'tick'])
+def take_snapshot():
+    """
+    Take a snapshot of the current game, RNG state included
+    :return:
+    """
+    return snapshot.Snapshot.take(field, (attractor, attractor2), tetris,
+                                  score=score.score, building=building,
+                                  rng=random)
+
 
 # Game objects
 # Init here so that the same objects can be reused (and safely created and
 # destroyed) between multiple games
-atlas = Atlas(XpLoader('indirectris.xp'), 'indirectris.json')
+board_size = BOARD_SIZE
+t = None
+dispatcher = None
+loop = None
+atlas = None
 field = None
 building = None
 tetris = None
 figures = None
+physics = None
 attractor = None
 attractor2 = None
 emitter = None
 score = None
 initial_figure = None
+trajectory = None
 sound = None
+r = None
+restart = None
+router = None
+losing = None
+dumper = None
+recorder = None
+initial_snapshot = None
+# Where F5 saves the game
+SAVE_PATH = 'indirectris.sav'
+
+
+def main(size=BOARD_SIZE):
+    """
+    Open the window and run the game.
+    
+    Nothing is started at import time, so that the other modules (and the
+    headless engine users) can import this one safely.
+    :param size: board size, tuple of ints (xsize, ysize). The window has 5
+    more rows for the bottom bar, so xsize should be at least MIN_BOARD_WIDTH
+    :return:
+    """
+    global board_size
+    global t
+    global dispatcher
+    global loop
+    global atlas
+    global r
+    global router
+    global restart
+    global losing
+    global dumper
+    global recorder
+    global initial_snapshot
+    board_size = size
+    # Standart BLT boilerplate
+    t = DirtyTerminal(font_path='cp437_12x12.png',
+                     size='{}x{}'.format(size[0], size[1] + 5),
+                     title='Indirectris', filter=['keyboard', 'mouse'])
+    dispatcher = BearEventDispatcher()
+    dispatcher.register_event_type('request_destruction')
+    dispatcher.register_event_type('request_installation')
+    dispatcher.register_event_type('h7')
+    dispatcher.register_event_type('v7')
+    dispatcher.register_event_type('square')
+    dispatcher.register_event_type('game_lost')
+    # Physics runs at a fixed rate, and stops while the loss screen is shown
+    loop = FixedStepLoop(t, dispatcher, timestep=TIMESTEP,
+                         idle=lambda: losing is not None and losing.showing)
+    closing = ClosingListener()
+    dispatcher.register_listener(closing, ['misc_input', 'tick'])
+    atlas = load_atlas('indirectris.xp', 'indirectris.json',
+                       'indirectris.bundle')
+    
+    # Debug stuff
+    r = Refresher(t)
+    restart = RestartButton('RESTART', color='#ff0000ff')
+    losing = LosingListener(t, Widget(*atlas.get_element('loss')))
+    dispatcher.register_listener(losing, 'game_lost')
+    dispatcher.register_listener(r, 'service')
+    # All the mouse input goes through the router
+    router = InputRouter(t)
+    dispatcher.register_listener(router, ['key_down', 'key_up', 'misc_input'])
+    dispatcher.register_listener(SaveListener(SAVE_PATH), 'key_up')
+    # Profiling is off unless INDIRECTRIS_PROFILE is set to the output path
+    profile_path = os.environ.get('INDIRECTRIS_PROFILE')
+    if profile_path:
+        profiler = Profiler()
+        profiler.instrument_engine()
+        profiler.instrument_loop(loop)
+        dumper = ProfileDumper(profiler, profile_path)
+        dispatcher.register_listener(dumper, 'key_up')
+        atexit.register(profiler.dump, profile_path)
+    # Same for recording the game for replay.py
+    record_path = os.environ.get('INDIRECTRIS_RECORD')
+    if record_path:
+        recorder = Recorder(record_path, board_size)
+        atexit.register(recorder.close)
+    
+    t.start()
+    init_game()
+    # Every later game starts from a copy of this one
+    initial_snapshot = snapshot.Snapshot.take(field, (attractor, attractor2),
+                                              tetris, building=building)
+    t.add_widget(Widget(*atlas.get_element('bottom_bar')),
+                 pos=(0, board_size[1]), layer=0)
+    t.add_widget(restart, pos=(49, board_size[1] + 2), layer=1)
+    router.add(restart)
+    loop.run()
+
 
-# Debug stuff
-r = Refresher(t)
-restart = RestartButton('RESTART', color='#ff0000ff')
-losing = LosingListener(t, Widget(*atlas.get_element('loss')))
-dispatcher.register_listener(losing, 'game_lost')
-dispatcher.register_listener(r, 'service')
-dispatcher.register_listener(restart, 'key_down')
-
-t.start()
-init_game()
-t.add_widget(Widget(*atlas.get_element('bottom_bar')), pos=(0, 45), layer=0)
-t.add_widget(restart, pos=(49, 47), layer=1)
-loop.run()
+if __name__ == '__main__':
+    # Board size can be set as WIDTHxHEIGHT, eg `indirectris.py 120x90`
+    if len(sys.argv) > 1:
+        try:
+            size = tuple(int(x) for x in sys.argv[1].split('x'))
+        except ValueError:
+            size = ()
+        if len(size) != 2:
+            sys.exit('Board size should be WIDTHxHEIGHT, eg 120x90')
+        if size[0] < MIN_BOARD_WIDTH:
+            sys.exit('Board should be at least {} cells wide to fit the '
+                     'bottom bar'.format(MIN_BOARD_WIDTH))
+        main(size)
+    else:
+        main()
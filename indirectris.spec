@@ -6,7 +6,7 @@ block_cipher = None
 a = Analysis(['indirectris.py'],
              pathex=['/home/morozov/minor_projects/indirectris'],
              binaries=[],
-             datas=[('cp437_12x12.png', '.'), ('indirectris.xp', '.'), ('indirectris.json', '.'), ('/usr/local/lib/python3.6/site-packages/bearlibterminal/libBearLibTerminal.so', '.'), ('Fail.wav', '.'), ('Fly.wav', '.'), ('Connect.wav', '.'), ('Explosion.wav', '.')],
+             datas=[('cp437_12x12.png', '.'), ('indirectris.bundle', '.'), ('/usr/local/lib/python3.6/site-packages/bearlibterminal/libBearLibTerminal.so', '.'), ('Fail.wav', '.'), ('Fly.wav', '.'), ('Connect.wav', '.'), ('Explosion.wav', '.')],
              hiddenimports=[],
              hookspath=[],
              runtime_hooks=[],
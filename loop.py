@@ -0,0 +1,94 @@
+"""
+Game loop with a fixed physics timestep
+"""
+
+import time
+
+from bear_hug.bear_hug import BearLoop
+from bear_hug.event import BearEvent
+
+
+class FixedStepLoop(BearLoop):
+    """
+    A BearLoop that only sends ticks of the same length
+    
+    Real time between frames goes into an accumulator, and every frame sends
+    as many `timestep`-long ticks as fit into it. So the physics gives the same
+    results whatever the frame rate is. If the game falls behind, at most
+    `max_steps` ticks are sent per frame and the rest of the lag is dropped
+    rather than caught up with. Input and drawing happen once per frame.
+    
+    While `idle()` returns True (eg on the loss screen) no ticks are sent at
+    all, and the loop only wakes up every `1/idle_fps` seconds to check input.
+    """
+    def __init__(self, terminal, queue, fps=30, timestep=1/30, max_steps=5,
+                 idle=None, idle_fps=10):
+        """
+        
+        :param terminal: BearTerminal
+        :param queue: BearEventDispatcher
+        :param fps: frames per second
+        :param timestep: tick length, in seconds
+        :param max_steps: max number of ticks per frame
+        :param idle: a callable that returns True when there is nothing to
+        simulate. If None, the loop is never idle
+        :param idle_fps: frames per second while idle
+        """
+        super().__init__(terminal, queue, fps=fps)
+        self.timestep = timestep
+        self.max_steps = max_steps
+        self.idle = idle
+        self.idle_frame_time = 1 / idle_fps
+        self.accumulator = 0
+    
+    def is_idle(self):
+        return self.idle is not None and self.idle()
+    
+    def run(self):
+        """
+        Start a loop.
+        
+        It would run until stopped with ``self.stop()``
+        """
+        # An imaginary "zeroth" frame, so that the first one has a tick
+        self.last_time = time.perf_counter() - self.frame_time
+        while not self.stopped:
+            now = time.perf_counter()
+            elapsed = now - self.last_time
+            self.last_time = now
+            self._run_iteration(elapsed)
+            if self.is_idle():
+                frame_time = self.idle_frame_time
+            else:
+                frame_time = self.frame_time
+            # Nothing is due until the next frame
+            sleep_time = self.last_time + frame_time - time.perf_counter()
+            if sleep_time > 0:
+                time.sleep(sleep_time)
+        self.terminal.close()
+    
+    def _run_iteration(self, time_since_last_frame):
+        for event in self.terminal.check_input():
+            self.queue.add_event(event)
+        if self.is_idle():
+            # Time spent idle is not simulated later
+            self.accumulator = 0
+        else:
+            self.accumulator += time_since_last_frame
+            steps = 0
+            while self.accumulator >= self.timestep and \
+                    steps < self.max_steps:
+                self.queue.add_event(BearEvent(event_type='tick',
+                                               event_value=self.timestep))
+                self.queue.dispatch_events()
+                self.accumulator -= self.timestep
+                steps += 1
+            if self.accumulator >= self.timestep:
+                # Too far behind, drop the lag
+                self.accumulator %= self.timestep
+        # Input still needs to be delivered if there were no ticks
+        self.queue.dispatch_events()
+        self.queue.add_event(BearEvent(event_type='service',
+                                       event_value='tick_over'))
+        self.queue.dispatch_events()
+        self.terminal.refresh()
@@ -0,0 +1,140 @@
+"""
+Mouse input routing
+
+Widgets that react to the mouse don't listen to input events themselves.
+A single InputRouter gets those events, reads the mouse position once per
+event and passes it on to the widget under the cursor.
+"""
+
+
+class InputRouter:
+    """
+    Delivers mouse clicks and drags to the widgets under the cursor
+
+    A routed widget implements `press(x, y)`, which is called when the left
+    button goes down over it. If that returns True, the widget is grabbed:
+    it gets every mouse move as `drag(x, y)` and the button release as
+    `release(x, y)`, wherever the cursor is, and nothing else gets pressed
+    until then. Of overlapping widgets, the one on the highest layer is
+    pressed. bear_hug repeats key_down while the button is held, so only the
+    first one after a key_up counts as a press.
+
+    Widget rectangles are kept in a grid of `cell`-sized buckets, so finding
+    what's under the cursor costs the same however many widgets there are.
+    A grabbed widget is reindexed after every drag, but the router has to be
+    told with `update` when a routed widget is moved by anything else.
+    """
+    def __init__(self, terminal, cell=8):
+        """
+
+        :param terminal: BearTerminal the widgets are on
+        :param cell: side of a grid bucket, in chars
+        """
+        self.terminal = terminal
+        self.cell = cell
+        # Bucket coordinates to widgets, and widgets to their rects
+        self.buckets = {}
+        self.rects = {}
+        self.grabbed = None
+        # Whether the left button is down
+        self.pressed = False
+
+    def add(self, widget):
+        """
+        Start routing mouse input to a widget that is on the terminal
+        :param widget:
+        :return:
+        """
+        self.rects[widget] = None
+        self.update(widget)
+
+    def remove(self, widget):
+        self.unindex(widget)
+        del self.rects[widget]
+        if self.grabbed is widget:
+            self.grabbed = None
+
+    def update(self, widget):
+        """
+        Reindex a widget at its current position
+        :param widget:
+        :return:
+        """
+        self.unindex(widget)
+        location = self.terminal.widget_locations[widget]
+        x, y = location.pos
+        # Inclusive on all sides, which is the area the widgets used to check
+        # themselves
+        rect = (x, y, x + widget.width, y + widget.height, location.layer)
+        self.rects[widget] = rect
+        for key in self.bucket_keys(rect):
+            self.buckets.setdefault(key, []).append(widget)
+
+    def unindex(self, widget):
+        rect = self.rects.get(widget)
+        if rect is None:
+            return
+        for key in self.bucket_keys(rect):
+            self.buckets[key].remove(widget)
+            if not self.buckets[key]:
+                del self.buckets[key]
+        self.rects[widget] = None
+
+    def bucket_keys(self, rect):
+        x0, y0, x1, y1, layer = rect
+        return [(x, y) for x in range(x0 // self.cell, x1 // self.cell + 1)
+                for y in range(y0 // self.cell, y1 // self.cell + 1)]
+
+    def find(self, x, y):
+        """
+        Return the topmost routed widget at a given point
+        :param x:
+        :param y:
+        :return: widget or None
+        """
+        r = None
+        top = None
+        for widget in self.buckets.get((x // self.cell, y // self.cell), ()):
+            x0, y0, x1, y1, layer = self.rects[widget]
+            if x0 <= x <= x1 and y0 <= y <= y1 and \
+                    (top is None or layer >= top):
+                r = widget
+                top = layer
+        return r
+
+    def release(self):
+        """
+        Drop the grabbed widget, if any, without telling it
+        :return:
+        """
+        self.grabbed = None
+
+    def mouse(self):
+        return (self.terminal.check_state('TK_MOUSE_X'),
+                self.terminal.check_state('TK_MOUSE_Y'))
+
+    def on_event(self, event):
+        if event.event_type == 'key_down' and \
+                event.event_value == 'TK_MOUSE_LEFT':
+            if self.pressed or self.grabbed is not None:
+                # A repeat while the button is held
+                return
+            self.pressed = True
+            x, y = self.mouse()
+            target = self.find(x, y)
+            if target is not None and target.press(x, y):
+                self.grabbed = target
+        elif event.event_type == 'misc_input' and \
+                event.event_value == 'TK_MOUSE_MOVE' and \
+                self.grabbed is not None:
+            self.grabbed.drag(*self.mouse())
+            if self.grabbed is not None:
+                self.update(self.grabbed)
+        elif event.event_type == 'key_up' and \
+                event.event_value == 'TK_MOUSE_LEFT':
+            self.pressed = False
+            if self.grabbed is None:
+                return
+            target = self.grabbed
+            self.grabbed = None
+            target.release(*self.mouse())
@@ -0,0 +1,222 @@
+"""
+Opt-in profiling
+
+Nothing here runs unless a Profiler is installed: it replaces the methods it
+times with wrappers, and puts the originals back on `uninstall`, so a game
+without a profiler runs exactly the same code as before.
+"""
+
+import functools
+import json
+import time
+
+import numpy as np
+
+from engine import GravityField, AsyncGravityField, OnDemandGravityField, \
+    TetrisSystem, FigureSwarm
+
+
+# Histogram bins for call durations: 1us to 1s, three per decade
+HISTOGRAM_EDGES = np.logspace(-6, 0, 19)
+
+
+class Probe:
+    """
+    Timings of a single method
+
+    Keeps the last `size` call durations and the last `size` per-frame call
+    counts and totals in ring buffers, so its memory use doesn't grow however
+    long the game runs.
+    """
+    __slots__ = ('name', 'size', 'durations', 'calls', 'time',
+                 'frame_calls', 'frame_times', 'frames', 'current_calls',
+                 'current_time')
+
+    def __init__(self, name, size=4096):
+        self.name = name
+        self.size = size
+        self.durations = np.zeros(size)
+        self.frame_calls = np.zeros(size, dtype=np.int64)
+        self.frame_times = np.zeros(size)
+        # Totals for the whole run
+        self.calls = 0
+        self.time = 0.0
+        self.frames = 0
+        # Totals for the current frame
+        self.current_calls = 0
+        self.current_time = 0.0
+
+    def record(self, duration):
+        self.durations[self.calls % self.size] = duration
+        self.calls += 1
+        self.time += duration
+        self.current_calls += 1
+        self.current_time += duration
+
+    def end_frame(self):
+        i = self.frames % self.size
+        self.frame_calls[i] = self.current_calls
+        self.frame_times[i] = self.current_time
+        self.frames += 1
+        self.current_calls = 0
+        self.current_time = 0.0
+
+    def summary(self):
+        """
+        Return a JSON-friendly dict of statistics
+        :return:
+        """
+        durations = self.durations[:min(self.calls, self.size)]
+        frame_times = self.frame_times[:min(self.frames, self.size)]
+        frame_calls = self.frame_calls[:min(self.frames, self.size)]
+        r = {'calls': self.calls, 'time': self.time}
+        if len(durations):
+            counts, _ = np.histogram(durations, bins=HISTOGRAM_EDGES)
+            r['recent_calls'] = {
+                'mean': float(durations.mean()),
+                'max': float(durations.max()),
+                'percentiles': {str(p): float(np.percentile(durations, p))
+                                for p in (50, 90, 99)},
+                'histogram': {'edges': HISTOGRAM_EDGES.tolist(),
+                              'counts': counts.tolist()}}
+        if len(frame_times):
+            r['recent_frames'] = {
+                'calls_mean': float(frame_calls.mean()),
+                'calls_max': int(frame_calls.max()),
+                'time_mean': float(frame_times.mean()),
+                'time_max': float(frame_times.max())}
+        return r
+
+
+class Profiler:
+    """
+    Times the game's hot paths
+
+    `instrument_engine` covers the field rebuilds and the collision and
+    removal checks, `instrument_loop` adds the frame itself, the terminal
+    refresh and the `on_event` of every listener class, including those
+    registered later. Times are inclusive, ie a listener's time contains the
+    engine calls it makes.
+    """
+    def __init__(self, size=4096):
+        self.size = size
+        self.probes = {}
+        # (owner, attribute, original value or None) for everything replaced
+        self.patched = []
+
+    def probe(self, name):
+        if name not in self.probes:
+            self.probes[name] = Probe(name, self.size)
+        return self.probes[name]
+
+    def wrap(self, owner, attr, name=None):
+        """
+        Replace a method with a timed one
+        :param owner: class (or any object) the method is defined in
+        :param attr: method name
+        :param name: probe name. Defaults to 'Owner.attr'
+        :return:
+        """
+        if any(x[0] is owner and x[1] == attr for x in self.patched):
+            return
+        func = getattr(owner, attr)
+        probe = self.probe(name or '{}.{}'.format(owner.__name__, attr))
+        clock = time.perf_counter
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                probe.record(clock() - start)
+        self.patched.append((owner, attr, owner.__dict__.get(attr)))
+        setattr(owner, attr, timed)
+
+    def wrap_listener(self, listener):
+        # Wraps every class in the MRO that defines its own on_event
+        for cls in type(listener).__mro__:
+            if 'on_event' in cls.__dict__:
+                self.wrap(cls, 'on_event')
+
+    def instrument_engine(self):
+        # The per-frame field and physics entry points, which is where the
+        # cost of the rebuilds below actually lands
+        self.wrap(GravityField, 'update')
+        self.wrap(GravityField, 'update_attractor')
+        self.wrap(GravityField, 'sample')
+        self.wrap(AsyncGravityField, 'update')
+        self.wrap(OnDemandGravityField, 'update')
+        self.wrap(OnDemandGravityField, 'sample')
+        self.wrap(FigureSwarm, 'step')
+        self.wrap(GravityField, 'rebuild_attractor_field')
+        self.wrap(GravityField, 'rebuild_sum_field')
+        self.wrap(OnDemandGravityField, 'calculate')
+        self.wrap(TetrisSystem, 'check_move')
+        self.wrap(TetrisSystem, 'check_for_removal')
+
+    def instrument_loop(self, loop):
+        """
+        Time frames, refreshes and listeners of a BearLoop
+
+        Every `loop._run_iteration` call is a frame, and the per-frame
+        statistics are collected after it.
+        :param loop: BearLoop
+        :return:
+        """
+        self.wrap(type(loop.terminal), 'refresh')
+        for listeners in loop.queue.listeners.values():
+            for listener in listeners:
+                self.wrap_listener(listener)
+        dispatcher_class = type(loop.queue)
+        register = dispatcher_class.register_listener
+        profiler = self
+
+        @functools.wraps(register)
+        def register_listener(dispatcher, listener, event_types='all'):
+            profiler.wrap_listener(listener)
+            return register(dispatcher, listener, event_types)
+        self.patched.append((dispatcher_class, 'register_listener',
+                             dispatcher_class.__dict__.get(
+                                 'register_listener')))
+        dispatcher_class.register_listener = register_listener
+        loop_class = type(loop)
+        self.wrap(loop_class, '_run_iteration', name='frame')
+        run_iteration = loop_class._run_iteration
+
+        @functools.wraps(run_iteration)
+        def frame(*args, **kwargs):
+            try:
+                return run_iteration(*args, **kwargs)
+            finally:
+                profiler.end_frame()
+        loop_class._run_iteration = frame
+
+    def end_frame(self):
+        for probe in self.probes.values():
+            probe.end_frame()
+
+    def uninstall(self):
+        """
+        Put all the original methods back
+        :return:
+        """
+        for owner, attr, original in reversed(self.patched):
+            if original is None:
+                delattr(owner, attr)
+            else:
+                setattr(owner, attr, original)
+        self.patched = []
+
+    def summary(self):
+        return {name: probe.summary()
+                for name, probe in sorted(self.probes.items())}
+
+    def dump(self, path):
+        """
+        Write the statistics as JSON
+        :param path:
+        :return:
+        """
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
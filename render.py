@@ -0,0 +1,72 @@
+"""
+Drawing only what has changed
+"""
+
+from bear_hug.bear_hug import BearTerminal, terminal
+from bear_hug.bear_utilities import BearException
+
+
+class DirtyTerminal(BearTerminal):
+    """
+    A BearTerminal that only refreshes the window when something was drawn
+
+    Every add, remove, move or update of a widget marks the terminal dirty,
+    and `refresh` does nothing until then. Widgets that only change a few of
+    their cells can redraw just those with `update_region`.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dirty = True
+
+    def update_region(self, widget, x, y, xsize, ysize):
+        """
+        Redraw a rectangular part of the widget
+
+        :param widget: a widget on this terminal
+        :param x: leftmost column, in widget coordinates
+        :param y: topmost row, in widget coordinates
+        :param xsize: region width
+        :param ysize: region height
+        :return:
+        """
+        if widget not in self.widget_locations:
+            raise BearException('Cannot update non-added Widgets')
+        pos = self.widget_locations[widget].pos
+        layer = self.widget_locations[widget].layer
+        x_end = min(x + xsize, widget.width)
+        y_end = min(y + ysize, widget.height)
+        x = max(x, 0)
+        y = max(y, 0)
+        if x >= x_end or y >= y_end:
+            return
+        terminal.layer(layer)
+        terminal.clear_area(pos[0] + x, pos[1] + y, x_end - x, y_end - y)
+        running_color = self.default_color
+        for y_offset in range(y, y_end):
+            chars = widget.chars[y_offset]
+            colors = widget.colors[y_offset]
+            for x_offset in range(x, x_end):
+                color = colors[x_offset]
+                if color and color != running_color:
+                    running_color = color
+                    terminal.color(running_color)
+                terminal.put(pos[0] + x_offset, pos[1] + y_offset,
+                             chars[x_offset])
+                self._widget_pointers[layer][pos[0] + x_offset]\
+                    [pos[1] + y_offset] = widget
+        if running_color != self.default_color:
+            terminal.color(self.default_color)
+        self.dirty = True
+
+    def update_widget(self, widget, refresh=False):
+        self.dirty = True
+        super().update_widget(widget, refresh=refresh)
+
+    def remove_widget(self, widget, refresh=False):
+        self.dirty = True
+        super().remove_widget(widget, refresh=refresh)
+
+    def refresh(self):
+        if self.dirty:
+            super().refresh()
+            self.dirty = False
@@ -0,0 +1,216 @@
+#! /usr/bin/env python3.6
+"""
+Recording games and replaying them headlessly
+
+A recording has everything the game logic depends on: the RNG seed of every
+game, the length of every tick and every attractor move, plus checkpoints of
+the score and the board. Replaying it through engine.Simulation gives exactly
+the same game, as fast as it can be calculated.
+
+The log is a header followed by records, each a type byte and a fixed-size
+payload (see RECORDS). It is only ever appended to, so a log from a crashed
+game is still good up to its last record.
+"""
+
+import struct
+import sys
+import time
+import zlib
+from collections import namedtuple
+
+from engine import Simulation
+
+
+MAGIC = b'IXRP'
+VERSION = 1
+# Magic, version, board size
+HEADER = struct.Struct('<4sHHH')
+RECORDS = {b'G': struct.Struct('<Q'),  # New game with this seed
+           b'D': struct.Struct('<d'),  # A tick of this length
+           b'T': struct.Struct(''),  # A tick as long as the previous one
+           b'M': struct.Struct('<Bhh'),  # Attractor index moved to x, y
+           b'C': struct.Struct('<III')}  # Ticks, score and board digest
+ReplayResult = namedtuple('ReplayResult', ('games', 'ticks', 'checkpoints',
+                                           'mismatches', 'seconds'))
+
+
+def board_digest(tetris):
+    """
+    Return a checksum of the installed cells
+    :param tetris: TetrisSystem
+    :return: int
+    """
+    digest = 0
+    for row in tetris.installed:
+        digest = zlib.crc32(row.to_bytes((tetris.size[0] + 7) // 8,
+                                         'little'), digest)
+    return digest
+
+
+class Recorder:
+    """
+    Writes a game log
+
+    Any object with `on_event` can be a listener, so a Recorder can be
+    registered for ticks directly. It should be the first tick listener, so
+    that every tick is recorded before it changes anything. Attractor moves
+    are picked up from the field when the next tick comes, as that's the only
+    time the field is used.
+    """
+    def __init__(self, path, size, checkpoint_every=300):
+        """
+
+        :param path: log file. Overwritten if it exists
+        :param size: board size
+        :param checkpoint_every: ticks between checkpoints
+        """
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, *size))
+        self.checkpoint_every = checkpoint_every
+        self.dt = None
+        self.field = None
+        self.attractors = ()
+        self.positions = []
+        self.tetris = None
+        self.score = None
+        self.ticks = 0
+
+    def write(self, record_type, *values):
+        self.file.write(record_type)
+        self.file.write(RECORDS[record_type].pack(*values))
+
+    def start_game(self, seed, field, attractors, tetris, score):
+        """
+        Start recording a new game
+
+        `random.seed(seed)` should be called right before the game is set up.
+        :param seed: RNG seed
+        :param field: GravityField
+        :param attractors: list of attractors, in engine.Simulation's order
+        :param tetris: TetrisSystem
+        :param score: anything with a `score` attribute
+        :return:
+        """
+        self.end_game()
+        self.write(b'G', seed)
+        self.field = field
+        self.attractors = attractors
+        self.positions = [field.positions[x] for x in attractors]
+        self.tetris = tetris
+        self.score = score
+        self.ticks = 0
+        # The first tick of every game has its length recorded
+        self.dt = None
+
+    def end_game(self):
+        """
+        Finish recording the current game
+
+        Needed if the game objects are about to be reused for the next game,
+        as start_game would only see them after they were reset.
+        :return:
+        """
+        if self.tetris is not None:
+            self.checkpoint()
+            self.tetris = None
+
+    def tick(self, dt):
+        for i, attractor in enumerate(self.attractors):
+            pos = self.field.positions[attractor]
+            if pos != self.positions[i]:
+                self.write(b'M', i, *pos)
+                self.positions[i] = pos
+        if dt == self.dt:
+            self.write(b'T')
+        else:
+            self.write(b'D', dt)
+            self.dt = dt
+        self.ticks += 1
+
+    def checkpoint(self):
+        self.write(b'C', self.ticks, self.score.score,
+                   board_digest(self.tetris))
+        self.file.flush()
+
+    def on_event(self, event):
+        if event.event_type == 'tick' and self.tetris is not None:
+            if self.ticks and self.ticks % self.checkpoint_every == 0:
+                self.checkpoint()
+            self.tick(event.event_value)
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.tetris is not None:
+            self.checkpoint()
+        self.file.close()
+
+
+def read_log(path):
+    """
+    Iterate over the records of a log
+    :param path:
+    :return: board size, then (record type, values) tuples
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, *size = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('{} is not a version {} game log'.format(path,
+                                                                 VERSION))
+    yield tuple(size)
+    offset = HEADER.size
+    while offset < len(data):
+        record_type = data[offset:offset + 1]
+        record = RECORDS[record_type]
+        if offset + 1 + record.size > len(data):
+            # Cut short, eg by a crash
+            break
+        yield record_type, record.unpack_from(data, offset + 1)
+        offset += 1 + record.size
+
+
+def replay(path):
+    """
+    Replay a log as fast as possible, checking every checkpoint
+    :param path:
+    :return: ReplayResult. `mismatches` is a list of (game, recorded
+    checkpoint, replayed checkpoint) tuples
+    """
+    start = time.perf_counter()
+    records = read_log(path)
+    size = next(records)
+    simulation = None
+    games = ticks = checkpoints = 0
+    mismatches = []
+    dt = None
+    for record_type, values in records:
+        if record_type == b'G':
+            simulation = Simulation(size, seed=values[0])
+            games += 1
+        elif record_type == b'M':
+            simulation.move_attractor(values[0], (values[1], values[2]))
+        elif record_type in (b'D', b'T'):
+            if record_type == b'D':
+                dt = values[0]
+            simulation.step(dt)
+            ticks += 1
+        elif record_type == b'C':
+            checkpoints += 1
+            replayed = (simulation.ticks, simulation.score,
+                        board_digest(simulation.tetris))
+            if replayed != values:
+                mismatches.append((games, values, replayed))
+    return ReplayResult(games, ticks, checkpoints, mismatches,
+                        time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    # `replay.py game.log`
+    result = replay(sys.argv[1])
+    print('{} games, {} ticks, {} checkpoints in {:.2f}s'.format(
+        result.games, result.ticks, result.checkpoints, result.seconds))
+    for game, recorded, replayed in result.mismatches:
+        print('Game {}: recorded (ticks, score, board) {}, replayed {}'.format(
+            game, recorded, replayed))
+    sys.exit(1 if result.mismatches else 0)
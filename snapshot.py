@@ -0,0 +1,317 @@
+#! /usr/bin/env python3.6
+"""
+Compact binary snapshots of the game state
+
+A snapshot has the board cells, the building's chars and colors, attractor
+positions and masses, the field they make, the score and the RNG state. It
+can be taken from and restored into both the front end's objects and an
+engine.Simulation's, written to a file and read back, eg
+
+    snap = Snapshot.take(sim.field, sim.attractors, sim.tetris,
+                         score=sim.score, rng=sim.rng)
+    save('board.snap', snap)
+    ...
+    load('board.snap').restore(sim.field, sim.attractors, sim.tetris,
+                               rng=sim.rng)
+
+Restoring copies the stored arrays into the existing objects and calculates
+nothing, so it's also the fast way to restart a game.
+
+The file is a header, the RNG state and the attractors (see the structs
+below) followed by a zlib-compressed body: the board as two bits per cell,
+the building's palettes and palette indices, and the field as float64s.
+"""
+
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+from engine import Gravcell, CHUNKED_AREA
+from storage import ChunkedGrid, PaletteGrid
+
+
+MAGIC = b'IXSN'
+VERSION = 1
+# Magic, version, board size, number of attractors, flags, score
+HEADER = struct.Struct('<4sHHHHBI')
+# Version, Mersenne Twister state and position, whether there is a cached
+# gaussian, and the gaussian
+RNG = struct.Struct('<B625I?d')
+# Position, mass, mass center
+ATTRACTOR = struct.Struct('<hhdhh')
+# Flags for the optional parts
+HAS_RNG = 1
+HAS_BUILDING = 2
+HAS_FIELD = 4
+
+
+def dense(cells, size):
+    # A dense copy of an array or a ChunkedGrid
+    if isinstance(cells, ChunkedGrid):
+        return cells.region(0, 0, *size)
+    return np.array(cells)
+
+
+def pack_rows(rows, width):
+    """
+    Pack TetrisSystem row masks into bytes
+    :param rows: list of ints
+    :param width: board width
+    :return:
+    """
+    row_bytes = (width + 7) // 8
+    return b''.join(row.to_bytes(row_bytes, 'little') for row in rows)
+
+
+def unpack_rows(data, size):
+    """
+    Unpack row masks packed by `pack_rows`
+    :param data: bytes
+    :param size: board size
+    :return: list of ints and a (xsize, ysize) bool array
+    """
+    row_bytes = (size[0] + 7) // 8
+    rows = [int.from_bytes(data[i:i + row_bytes], 'little')
+            for i in range(0, size[1] * row_bytes, row_bytes)]
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8).reshape(
+        size[1], row_bytes), axis=1, bitorder='little')
+    return rows, bits[:, :size[0]].T.astype(bool)
+
+
+def pack_palette_grid(grid, size):
+    values = [value.encode('utf-8') for value in grid.palette]
+    codes = dense(grid.codes, (size[1], size[0]))
+    return b''.join([struct.pack('<HB', len(values), codes.itemsize)] +
+                    [struct.pack('<H', len(x)) + x for x in values] +
+                    [codes.tobytes()])
+
+
+def unpack_palette_grid(data, offset, size, chunked):
+    """
+    Read a PaletteGrid written by `pack_palette_grid`
+    :param data: bytes
+    :param offset: where the grid starts
+    :param size: board size
+    :param chunked: whether the grid should be chunked
+    :return: PaletteGrid and the offset after it
+    """
+    count, itemsize = struct.unpack_from('<HB', data, offset)
+    offset += 3
+    grid = PaletteGrid.__new__(PaletteGrid)
+    grid.palette = []
+    for _ in range(count):
+        length, = struct.unpack_from('<H', data, offset)
+        grid.palette.append(data[offset + 2:offset + 2 + length].decode(
+            'utf-8'))
+        offset += 2 + length
+    grid.index = {value: i for i, value in enumerate(grid.palette)}
+    end = offset + size[0] * size[1] * itemsize
+    codes = np.frombuffer(data[offset:end], dtype=np.dtype(
+        '<u{}'.format(itemsize))).reshape(size[1], size[0]).copy()
+    grid.codes = ChunkedGrid.from_array(codes) if chunked else codes
+    return grid, end
+
+
+class Snapshot:
+    """
+    The state of a game at some moment
+
+    Everything in it is a private copy, so it can be restored any number of
+    times. Flying figures and the emitter are not included: restoring a
+    snapshot is meant to be followed by starting them over, like a new game
+    does.
+    """
+    def __init__(self, size, score=0, rng_state=None, attractors=(),
+                 installed=None, destroy=None, cells=None, chars=None,
+                 colors=None, field=None):
+        """
+
+        :param size: board size
+        :param score: score
+        :param rng_state: whatever `random.getstate()` returns, or None
+        :param attractors: list of (position, mass, mass center) tuples
+        :param installed: TetrisSystem.installed row masks
+        :param destroy: TetrisSystem.destroy row masks
+        :param cells: TetrisSystem cells as a dense (xsize, ysize) array
+        :param chars: building chars as a PaletteGrid, or None
+        :param colors: building colors as a PaletteGrid, or None
+        :param field: sum field as a Gravcell, or None
+        """
+        self.size = tuple(size)
+        self.score = score
+        self.rng_state = rng_state
+        self.attractors = list(attractors)
+        self.installed = installed
+        self.destroy = destroy
+        self.cells = cells
+        self.chars = chars
+        self.colors = colors
+        self.field = field
+
+    @classmethod
+    def take(cls, field, attractors, tetris, score=0, building=None,
+             rng=None):
+        """
+        Take a snapshot of a game
+
+        :param field: GravityField
+        :param attractors: attractors in the field, in a fixed order
+        :param tetris: TetrisSystem
+        :param score: score
+        :param building: gravity.BuildingWidget, if any
+        :param rng: anything with `getstate`, eg random.Random or the random
+        module, if its state should be saved
+        :return:
+        """
+        # Not every field has all of it ready
+        sum_field = field.materialize()
+        return cls(tetris.size, score=score,
+                   rng_state=rng.getstate() if rng else None,
+                   attractors=[(tuple(field.positions[x]), x.mass,
+                                tuple(x.mass_center)) for x in attractors],
+                   installed=list(tetris.installed),
+                   destroy=list(tetris.destroy),
+                   cells=dense(tetris.cells, tetris.size),
+                   chars=building.chars.copy() if building else None,
+                   colors=building.colors.copy() if building else None,
+                   field=Gravcell(sum_field.ax.copy(), sum_field.ay.copy()))
+
+    def restore(self, field, attractors, tetris, building=None, rng=None):
+        """
+        Put the snapshot's state into existing game objects
+
+        The score is left to the caller, as it lives in different places in
+        the front end and the Simulation.
+        :param field: GravityField with the attractors in it
+        :param attractors: attractors, in the same order as when taken
+        :param tetris: TetrisSystem of the same size
+        :param building: gravity.BuildingWidget. It's not redrawn
+        :param rng: anything with `setstate`, if the RNG state should be
+        restored
+        :return:
+        """
+        if tuple(tetris.size) != self.size:
+            raise ValueError('Snapshot of a {}x{} board restored into a '
+                             '{}x{} one'.format(*self.size, *tetris.size))
+        if len(attractors) != len(self.attractors):
+            raise ValueError('Snapshot has {} attractors, not {}'.format(
+                len(self.attractors), len(attractors)))
+        tetris.installed[:] = self.installed
+        tetris.destroy[:] = self.destroy
+        if isinstance(tetris.cells, ChunkedGrid):
+            tetris.cells = ChunkedGrid.from_array(self.cells)
+        else:
+            np.copyto(tetris.cells, self.cells)
+        if building is not None and self.chars is not None:
+            building.chars = self.chars.copy()
+            building.colors = self.colors.copy()
+        for attractor, (pos, mass, mass_center) in zip(attractors,
+                                                       self.attractors):
+            attractor.mass = mass
+            attractor.mass_center = mass_center
+        positions = {attractor: pos for attractor, (pos, mass, mass_center)
+                     in zip(attractors, self.attractors)}
+        if self.field is not None:
+            field.restore(positions, self.field)
+        else:
+            for attractor, pos in positions.items():
+                field.move_attractor(attractor, pos)
+        if rng is not None and self.rng_state is not None:
+            rng.setstate(self.rng_state)
+
+    def dumps(self, level=6):
+        """
+        Return the snapshot as bytes
+        :param level: zlib compression level
+        :return:
+        """
+        flags = 0
+        head = []
+        if self.rng_state is not None:
+            flags |= HAS_RNG
+            version, state, gauss = self.rng_state
+            head.append(RNG.pack(version, *state, gauss is not None,
+                                 gauss or 0.0))
+        head += [ATTRACTOR.pack(*pos, mass, *mass_center)
+                 for pos, mass, mass_center in self.attractors]
+        body = [pack_rows(self.installed, self.size[0]),
+                pack_rows(self.destroy, self.size[0])]
+        if self.chars is not None:
+            flags |= HAS_BUILDING
+            body += [pack_palette_grid(self.chars, self.size),
+                     pack_palette_grid(self.colors, self.size)]
+        if self.field is not None:
+            flags |= HAS_FIELD
+            body += [self.field.ax.astype('<f8').tobytes(),
+                     self.field.ay.astype('<f8').tobytes()]
+        return b''.join([HEADER.pack(MAGIC, VERSION, *self.size,
+                                     len(self.attractors), flags, self.score)]
+                        + head + [zlib.compress(b''.join(body), level)])
+
+    @classmethod
+    def loads(cls, data):
+        """
+        Read a snapshot from bytes
+        :param data:
+        :return:
+        """
+        magic, version, xsize, ysize, count, flags, score = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a version {} snapshot'.format(VERSION))
+        size = (xsize, ysize)
+        offset = HEADER.size
+        rng_state = None
+        if flags & HAS_RNG:
+            version, *state, has_gauss, gauss = RNG.unpack_from(data, offset)
+            rng_state = (version, tuple(state),
+                         gauss if has_gauss else None)
+            offset += RNG.size
+        attractors = []
+        for _ in range(count):
+            x, y, mass, cx, cy = ATTRACTOR.unpack_from(data, offset)
+            attractors.append(((x, y), mass, (cx, cy)))
+            offset += ATTRACTOR.size
+        body = zlib.decompress(data[offset:])
+        row_bytes = (xsize + 7) // 8 * ysize
+        installed, ones = unpack_rows(body[:row_bytes], size)
+        destroy, twos = unpack_rows(body[row_bytes:2 * row_bytes], size)
+        cells = ones.astype(np.uint8) + 2 * twos.astype(np.uint8)
+        offset = 2 * row_bytes
+        chars = colors = field = None
+        if flags & HAS_BUILDING:
+            chunked = xsize * ysize > CHUNKED_AREA
+            chars, offset = unpack_palette_grid(body, offset, size, chunked)
+            colors, offset = unpack_palette_grid(body, offset, size, chunked)
+        if flags & HAS_FIELD:
+            n = xsize * ysize * 8
+            field = Gravcell(*(np.frombuffer(
+                body[offset + i * n:offset + (i + 1) * n], dtype='<f8')
+                               .reshape(size).astype(float)
+                               for i in range(2)))
+        return cls(size, score=score, rng_state=rng_state,
+                   attractors=attractors, installed=installed,
+                   destroy=destroy, cells=cells, chars=chars, colors=colors,
+                   field=field)
+
+
+def save(path, snapshot):
+    with open(path, 'wb') as f:
+        f.write(snapshot.dumps())
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        return Snapshot.loads(f.read())
+
+
+if __name__ == '__main__':
+    # `snapshot.py board.snap` describes a snapshot
+    snap = load(sys.argv[1])
+    print('{}x{} board, score {}, {} installed cells, {} attractors{}{}'
+          .format(*snap.size, snap.score, int((snap.cells == 1).sum()),
+                  len(snap.attractors),
+                  ', building' if snap.chars is not None else '',
+                  ', field' if snap.field is not None else ''))
@@ -0,0 +1,242 @@
+"""
+Compact grid storage
+
+Array-backed replacements for the nested lists of chars and colors, with the
+same ``grid[y][x]`` lookup that bear_hug widgets expect.
+"""
+
+import numpy as np
+
+
+class PaletteRow:
+    """
+    A single row of a PaletteGrid
+    """
+    __slots__ = ('grid', 'y')
+
+    def __init__(self, grid, y):
+        self.grid = grid
+        self.y = y
+
+    def __getitem__(self, item):
+        return self.grid.palette[self.grid.codes[self.y, item]]
+
+    def __setitem__(self, key, value):
+        self.grid.codes[self.y, key] = self.grid.encode(value)
+
+    def __len__(self):
+        return self.grid.codes.shape[1]
+
+    def __iter__(self):
+        return (self[x] for x in range(len(self)))
+
+
+class PaletteGrid:
+    """
+    A 2D grid of values stored as indices into a palette
+
+    Chars and colors of a board are mostly the same few values, so every cell
+    only stores a one-byte index into the list of values seen so far. If there
+    ever are more than 256 of them, the indices are widened to two bytes. The
+    indices are either a numpy array or a ChunkedGrid, indexed as [y, x].
+
+    Looks like a list of rows: ``grid[y][x]`` reads and writes work, and
+    ``len(grid)`` is the number of rows.
+    """
+    __slots__ = ('codes', 'palette', 'index')
+
+    def __init__(self, rows):
+        """
+
+        :param rows: a list of lists of values, eg widget chars
+        """
+        self.palette = []
+        self.index = {}
+        self.codes = np.zeros((len(rows), len(rows[0])), dtype=np.uint8)
+        for y, row in enumerate(rows):
+            for x, value in enumerate(row):
+                self.codes[y, x] = self.encode(value)
+
+    @classmethod
+    def filled(cls, size, value, chunked=False):
+        """
+        Create a grid where every cell is the same value
+
+        Doesn't build any lists, so it's the way to make huge grids.
+        :param size: tuple of ints (xsize, ysize)
+        :param value: the value
+        :param chunked: if True, the indices are stored in a ChunkedGrid,
+        which only allocates chunks that have something other than `value`
+        :return:
+        """
+        r = cls.__new__(cls)
+        r.palette = [value]
+        r.index = {value: 0}
+        if chunked:
+            r.codes = ChunkedGrid((size[1], size[0]))
+        else:
+            r.codes = np.zeros((size[1], size[0]), dtype=np.uint8)
+        return r
+
+    def encode(self, value):
+        """
+        Return the palette index for a value, adding it if necessary
+        :param value:
+        :return:
+        """
+        try:
+            return self.index[value]
+        except KeyError:
+            if len(self.palette) > np.iinfo(self.codes.dtype).max:
+                self.codes = self.codes.astype(np.uint16)
+            self.index[value] = len(self.palette)
+            self.palette.append(value)
+            return self.index[value]
+
+    def copy(self):
+        """
+        Return an independent copy. Only the index array is actually copied
+        :return:
+        """
+        r = PaletteGrid.__new__(PaletteGrid)
+        r.codes = self.codes.copy()
+        r.palette = list(self.palette)
+        r.index = dict(self.index)
+        return r
+
+    def tolist(self):
+        return [[self.palette[code] for code in row]
+                for row in self.codes.tolist()]
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes
+
+    def __getitem__(self, item):
+        return PaletteRow(self, item)
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    def __iter__(self):
+        return (PaletteRow(self, y) for y in range(self.codes.shape[0]))
+
+
+class ChunkedGrid:
+    """
+    A sparse 2D array made of square chunks
+
+    Supports ``grid[x, y]`` reads and writes like a numpy array does, but a
+    chunk is only allocated when a nonzero value is written into it. Reading
+    from an unallocated chunk returns zero. It's meant for huge boards that
+    are mostly empty.
+    """
+    __slots__ = ('shape', 'chunk', 'dtype', 'chunks')
+
+    def __init__(self, shape, chunk=64, dtype=np.uint8):
+        """
+
+        :param shape: tuple of ints; the grid is indexed in the same order
+        :param chunk: chunk side, in cells
+        :param dtype: numpy dtype of the values
+        """
+        self.shape = tuple(shape)
+        self.chunk = chunk
+        self.dtype = np.dtype(dtype)
+        self.chunks = {}
+
+    def _locate(self, item):
+        # Returns chunk key and offsets within it. Negative indices work the
+        # same way they do for arrays
+        a, b = item
+        if a < 0:
+            a += self.shape[0]
+        if b < 0:
+            b += self.shape[1]
+        if not (0 <= a < self.shape[0] and 0 <= b < self.shape[1]):
+            raise IndexError('ChunkedGrid index {} out of range'.format(item))
+        return (a // self.chunk, b // self.chunk), a % self.chunk, \
+            b % self.chunk
+
+    def __getitem__(self, item):
+        key, a, b = self._locate(item)
+        try:
+            return self.chunks[key][a, b]
+        except KeyError:
+            return self.dtype.type(0)
+
+    def __setitem__(self, key, value):
+        key, a, b = self._locate(key)
+        if key not in self.chunks:
+            if not value:
+                return
+            self.chunks[key] = np.zeros((self.chunk, self.chunk),
+                                        dtype=self.dtype)
+        self.chunks[key][a, b] = value
+
+    def region(self, a, b, size_a, size_b):
+        """
+        Return a dense copy of a rectangular region
+
+        The parts of the region outside the grid are left out.
+        :param a: start along the first axis
+        :param b: start along the second axis
+        :param size_a: region size along the first axis
+        :param size_b: region size along the second axis
+        :return: numpy array
+        """
+        a_end = min(a + size_a, self.shape[0])
+        b_end = min(b + size_b, self.shape[1])
+        a = max(a, 0)
+        b = max(b, 0)
+        r = np.zeros((a_end - a, b_end - b), dtype=self.dtype)
+        for ka in range(a // self.chunk, (a_end - 1) // self.chunk + 1):
+            for kb in range(b // self.chunk, (b_end - 1) // self.chunk + 1):
+                if (ka, kb) not in self.chunks:
+                    continue
+                # Overlap of this chunk and the region, in grid coordinates
+                a0 = max(a, ka * self.chunk)
+                a1 = min(a_end, (ka + 1) * self.chunk)
+                b0 = max(b, kb * self.chunk)
+                b1 = min(b_end, (kb + 1) * self.chunk)
+                r[a0 - a:a1 - a, b0 - b:b1 - b] = self.chunks[ka, kb][
+                    a0 - ka * self.chunk:a1 - ka * self.chunk,
+                    b0 - kb * self.chunk:b1 - kb * self.chunk]
+        return r
+
+    @classmethod
+    def from_array(cls, array, chunk=64):
+        """
+        Make a ChunkedGrid with the same values as a dense array
+
+        Only the chunks with something other than zero are allocated.
+        :param array: 2D numpy array
+        :param chunk: chunk side, in cells
+        :return:
+        """
+        r = cls(array.shape, chunk=chunk, dtype=array.dtype)
+        for a in range(0, array.shape[0], chunk):
+            for b in range(0, array.shape[1], chunk):
+                block = array[a:a + chunk, b:b + chunk]
+                if block.any():
+                    r.chunks[a // chunk, b // chunk] = np.zeros(
+                        (chunk, chunk), dtype=r.dtype)
+                    r.chunks[a // chunk, b // chunk][:block.shape[0],
+                                                     :block.shape[1]] = block
+        return r
+
+    def astype(self, dtype):
+        r = ChunkedGrid(self.shape, chunk=self.chunk, dtype=dtype)
+        r.chunks = {key: value.astype(dtype)
+                    for key, value in self.chunks.items()}
+        return r
+
+    def copy(self):
+        return self.astype(self.dtype)
+
+    def tolist(self):
+        return self.region(0, 0, *self.shape).tolist()
+
+    @property
+    def nbytes(self):
+        return sum(chunk.nbytes for chunk in self.chunks.values())